@@ -2,34 +2,98 @@
 
 import { useState, useEffect, useRef } from "react";
 
+// Must match the wire format in aurora-python/frame_diff.py.
+const KEYFRAME = 1;
+const DELTA = 2;
+const KEYFRAME_HEADER_SIZE = 5;
+const DELTA_HEADER_SIZE = 7;
+const TILE_HEADER_SIZE = 12;
+
+async function drawFrame(canvas: HTMLCanvasElement, buffer: ArrayBuffer) {
+  const view = new DataView(buffer);
+  const type = view.getUint8(0);
+  const width = view.getUint16(1);
+  const height = view.getUint16(3);
+  const ctx = canvas.getContext("2d");
+  if (!ctx) return;
+
+  if (type === KEYFRAME) {
+    const bitmap = await createImageBitmap(
+      new Blob([buffer.slice(KEYFRAME_HEADER_SIZE)], { type: "image/jpeg" })
+    );
+    if (canvas.width !== width || canvas.height !== height) {
+      canvas.width = width;
+      canvas.height = height;
+    }
+    ctx.drawImage(bitmap, 0, 0);
+    bitmap.close();
+    return;
+  }
+
+  if (type === DELTA) {
+    const tileCount = view.getUint16(5);
+    let offset = DELTA_HEADER_SIZE;
+    const tiles = [];
+    for (let i = 0; i < tileCount; i++) {
+      const x = view.getUint16(offset);
+      const y = view.getUint16(offset + 2);
+      const length = view.getUint32(offset + 8);
+      offset += TILE_HEADER_SIZE;
+      const blob = new Blob([buffer.slice(offset, offset + length)], {
+        type: "image/jpeg",
+      });
+      offset += length;
+      tiles.push({ x, y, bitmap: createImageBitmap(blob) });
+    }
+    for (const tile of tiles) {
+      const bitmap = await tile.bitmap;
+      ctx.drawImage(bitmap, tile.x, tile.y);
+      bitmap.close();
+    }
+  }
+}
+
 export default function BrowserView() {
-  const [imageUrl, setImageUrl] = useState<string | null>(null);
+  const [hasFrame, setHasFrame] = useState(false);
   const [isConnected, setIsConnected] = useState(false);
+  const [droppedFrames, setDroppedFrames] = useState(0);
   const ws = useRef<WebSocket | null>(null);
+  const canvasRef = useRef<HTMLCanvasElement | null>(null);
 
   useEffect(() => {
     if (!isConnected) return;
 
     ws.current = new WebSocket("ws://localhost:8000/ws/agent");
+    ws.current.binaryType = "arraybuffer";
 
-    let lastObjectUrl: string | null = null;
+    // Deltas are relative to the previous frame, so frames must be drawn in
+    // the order they arrive.
+    let drawQueue = Promise.resolve();
 
     ws.current.onmessage = (event) => {
-      if (lastObjectUrl) {
-        URL.revokeObjectURL(lastObjectUrl);
+      if (typeof event.data === "string") {
+        const message = JSON.parse(event.data);
+        if (message.type === "frame_stats") {
+          setDroppedFrames(message.dropped);
+        }
+        return;
       }
-      const newUrl = URL.createObjectURL(event.data);
-      setImageUrl(newUrl);
-      lastObjectUrl = newUrl;
+      const buffer = event.data as ArrayBuffer;
+      drawQueue = drawQueue
+        .then(async () => {
+          if (canvasRef.current) {
+            await drawFrame(canvasRef.current, buffer);
+            setHasFrame(true);
+          }
+        })
+        .catch((error) => console.error("Error drawing frame:", error));
     };
 
     ws.current.onclose = () => {
       console.log("WebSocket disconnected");
       setIsConnected(false);
-      if (lastObjectUrl) {
-        URL.revokeObjectURL(lastObjectUrl);
-      }
-      setImageUrl(null);
+      setHasFrame(false);
+      setDroppedFrames(0);
     };
 
     ws.current.onerror = (error) => {
@@ -46,6 +110,11 @@ export default function BrowserView() {
     <div className="flex flex-col h-full">
       <div className="p-2 text-white text-center">
         <h2 className="text-lg font-semibold">Agent Browser View</h2>
+        {isConnected && droppedFrames > 0 && (
+          <p className="text-xs text-gray-400">
+            {droppedFrames} frames skipped on a slow connection
+          </p>
+        )}
       </div>
       <div className="flex-1 flex items-center justify-center p-4">
         {!isConnected ? (
@@ -55,14 +124,19 @@ export default function BrowserView() {
           >
             Start Agent Session
           </button>
-        ) : imageUrl ? (
-          <img
-            src={imageUrl}
-            alt="Live view from the agent's browser"
-            className="w-full h-full object-contain"
-          />
         ) : (
-          <p className="text-gray-500 text-xl">Connecting to agent...</p>
+          <>
+            <canvas
+              ref={canvasRef}
+              aria-label="Live view from the agent's browser"
+              className={`w-full h-full object-contain ${
+                hasFrame ? "" : "hidden"
+              }`}
+            />
+            {!hasFrame && (
+              <p className="text-gray-500 text-xl">Connecting to agent...</p>
+            )}
+          </>
         )}
       </div>
     </div>
@@ -0,0 +1,108 @@
+from typing import Any, Dict, List, Tuple
+
+# Roles a user can type into; the rest of INTERACTIVE_ROLES are clicked.
+FORM_ROLES = {"textbox", "searchbox", "combobox", "spinbutton"}
+INTERACTIVE_ROLES = FORM_ROLES | {
+    "button",
+    "link",
+    "checkbox",
+    "radio",
+    "switch",
+    "tab",
+    "menuitem",
+    "menuitemcheckbox",
+    "menuitemradio",
+    "option",
+    "treeitem",
+    "slider",
+}
+# Ancestors worth naming as an element's context, e.g. which form or dialog
+# a "Submit" button belongs to.
+CONTEXT_ROLES = {
+    "form",
+    "dialog",
+    "alertdialog",
+    "navigation",
+    "search",
+    "banner",
+    "main",
+    "region",
+    "complementary",
+    "contentinfo",
+    "menu",
+    "tablist",
+}
+# AX properties copied onto the element record when present.
+STATE_PROPERTIES = ("checked", "expanded", "disabled", "required", "selected")
+
+
+def _value(field: Dict[str, Any] | None) -> Any:
+    return (field or {}).get("value")
+
+
+def interactive_elements(
+    ax_nodes: List[Dict[str, Any]],
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Prunes a CDP `Accessibility.getFullAXTree` result down to its interactive
+    nodes and splits them into (clickable, form) element records shaped like
+    the ones the DOM scan produces.
+
+    Each record's id is the node's backendDOMNodeId, which stays the same for
+    a DOM node for the life of its document. Nodes the browser marks as
+    ignored (hidden, inert, presentational) never make it into the tree.
+    """
+    by_id = {node["nodeId"]: node for node in ax_nodes}
+    clickable, form = [], []
+
+    for node in ax_nodes:
+        role = _value(node.get("role"))
+        if node.get("ignored") or role not in INTERACTIVE_ROLES:
+            continue
+        backend_id = node.get("backendDOMNodeId")
+        if backend_id is None:
+            continue
+
+        properties = {
+            prop["name"]: _value(prop.get("value"))
+            for prop in node.get("properties", [])
+        }
+        attributes = {}
+        value = _value(node.get("value"))
+        if value not in (None, ""):
+            attributes["value"] = str(value)
+        description = _value(node.get("description"))
+        if description:
+            attributes["description"] = description
+        for name in STATE_PROPERTIES:
+            # An unchecked box is worth stating; other states only when set.
+            if properties.get(name) not in (None, False, "false") or (
+                name == "checked" and name in properties
+            ):
+                attributes[name] = str(properties[name]).lower()
+        context = _context(node, by_id)
+        if context:
+            attributes["context"] = context
+
+        record = {
+            "id": backend_id,
+            "visible": True,
+            "tag": role,
+            "text": (_value(node.get("name")) or "").strip(),
+            "attributes": attributes,
+            "bbox": None,
+        }
+        (form if role in FORM_ROLES else clickable).append(record)
+
+    return clickable, form
+
+
+def _context(node: Dict[str, Any], by_id: Dict[str, Dict[str, Any]]) -> str | None:
+    parent = by_id.get(node.get("parentId"))
+    while parent:
+        role = _value(parent.get("role"))
+        if role in CONTEXT_ROLES:
+            name = (_value(parent.get("name")) or "").strip()
+            return f"{role} {name}".strip()
+        parent = by_id.get(parent.get("parentId"))
+    return None
@@ -1,4 +1,7 @@
+import asyncio
 import logging
+import os
+import time
 from typing import AsyncGenerator
 
 from google.adk.agents import BaseAgent
@@ -6,30 +9,57 @@ from google.adk.agents.invocation_context import InvocationContext
 from google.adk.events import Event
 from typing_extensions import override
 
-from .execution_agent import execution_agent
+from browser_manager import current_browser, use_browser
+from macros import macro_store
+from plan_cache import plan_cache
+from progress import emit
+from telemetry import instrument_agents, span
+
+from .execution_agent import execution_agent, form_fill_agent, replay_step
 from .planning_agent import (
     Plan,
+    fast_planning_agent,
     planning_agent,
 )
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# How many sub-tasks of a plan may run at once, each in its own tab.
+MAX_PARALLEL_BRANCHES = int(os.getenv("AURORA_MAX_PARALLEL_BRANCHES", "3"))
+# "fast" plans in one structured call and falls back to the three-stage
+# pipeline if that fails; "full" always runs the three-stage pipeline.
+PLANNING_MODE = os.getenv("AURORA_PLANNING_MODE", "fast")
+
 
 class RootAgent(BaseAgent):
     planning_agent: BaseAgent
     execution_agent: BaseAgent
+    form_fill_agent: BaseAgent
+    # Tried before planning_agent when set; see AURORA_PLANNING_MODE.
+    fast_planning_agent: BaseAgent | None = None
 
     model_config = {"arbitrary_types_allowed": True}
 
     def __init__(
-        self, name: str, planning_agent: BaseAgent, execution_agent: BaseAgent, **kwargs
+        self,
+        name: str,
+        planning_agent: BaseAgent,
+        execution_agent: BaseAgent,
+        form_fill_agent: BaseAgent,
+        fast_planning_agent: BaseAgent | None = None,
+        **kwargs,
     ):
+        sub_agents = [planning_agent, execution_agent, form_fill_agent]
+        if fast_planning_agent:
+            sub_agents.append(fast_planning_agent)
         super().__init__(
             name=name,
             planning_agent=planning_agent,
             execution_agent=execution_agent,
-            sub_agents=[planning_agent, execution_agent],
+            form_fill_agent=form_fill_agent,
+            fast_planning_agent=fast_planning_agent,
+            sub_agents=sub_agents,
             **kwargs,
         )
 
@@ -37,73 +67,486 @@ class RootAgent(BaseAgent):
     async def _run_async_impl(
         self, ctx: InvocationContext
     ) -> AsyncGenerator[Event, None]:
-        # --- 1. Planning Phase (Runs Once) ---
-        logger.info(
-            f"[{self.name}] Running Planning Agent to generate the full plan..."
-        )
-        async for event in self.planning_agent.run_async(ctx):
-            yield event
-
-        plan_output = ctx.session.state.get("plan")
+        user_id = ctx.session.user_id
+        user_query = self._user_query(ctx)
+        macro = self._recorded_macro(user_id, user_query)
+        # What each completed step acted on, recorded as a macro on success.
+        trace = []
+        cache_key = None
 
-        if not plan_output or not isinstance(plan_output, dict):
-            logger.error(
-                f"[{self.name}] Planning agent did not produce a valid plan object. Aborting workflow."
+        if macro:
+            plan = Plan.model_validate({"steps": [entry["step"] for entry in macro]})
+            ctx.session.state["plan"] = plan.model_dump()
+            emit("plan", source="macro", steps=ctx.session.state["plan"]["steps"])
+            logger.info(
+                f"[{self.name}] Replaying recorded macro with {len(macro)} steps; skipping planning."
             )
-            return
-
-        try:
-            plan = Plan.model_validate(plan_output)
-        except Exception as e:
-            logger.error(
-                f"[{self.name}] Failed to validate the plan structure: {e}. Aborting."
+            async for event in self._replay(ctx, macro, trace):
+                yield event
+            if len(trace) == len(macro):
+                logger.info(
+                    f"[{self.name}] Macro replay finished. All {len(macro)} steps executed."
+                )
+                return
+            logger.warning(
+                f"[{self.name}] Macro replay stopped at step {len(trace) + 1}: "
+                f"{ctx.session.state.get('execution_error')}. Continuing with the agents."
             )
-            return
+        elif cached := self._cached_plan(user_id, user_query):
+            cache_key, plan = cached
+            ctx.session.state["plan"] = plan.model_dump()
+            emit("plan", source="cache", steps=ctx.session.state["plan"]["steps"])
+            logger.info(
+                f"[{self.name}] Reusing cached plan with {len(plan.steps)} steps; skipping planning."
+            )
+        else:
+            # --- 1. Planning Phase (Runs Once) ---
+            # A plan left in state by an earlier run must not pass for a new one.
+            ctx.session.state["plan"] = None
+            plan = None
+            try:
+                with span("aurora_planning_seconds") as attrs:
+                    if self.fast_planning_agent:
+                        attrs["mode"] = "fast"
+                        logger.info(
+                            f"[{self.name}] Running Fast Planning Agent to generate the full plan..."
+                        )
+                        try:
+                            async for event in self.fast_planning_agent.run_async(ctx):
+                                yield event
+                            plan = self._planned(ctx)
+                        except Exception as e:
+                            # ADK raises while parsing output that does not
+                            # fit the Plan schema; the pipeline can still plan.
+                            logger.error(f"[{self.name}] Fast planning raised: {e}")
+                            plan = None
+                        if plan is None:
+                            logger.warning(
+                                f"[{self.name}] Fast planning failed; falling back to the full planning pipeline."
+                            )
+                            ctx.session.state["plan"] = None
+                    if plan is None:
+                        attrs["mode"] = "full"
+                        logger.info(
+                            f"[{self.name}] Running Planning Agent to generate the full plan..."
+                        )
+                        async for event in self.planning_agent.run_async(ctx):
+                            yield event
+                        plan = self._planned(ctx)
+            except asyncio.CancelledError:
+                logger.warning(
+                    f"[{self.name}] Run cancelled during planning; no browser steps were executed."
+                )
+                raise
 
-        if not plan.steps:
-            logger.warning(
-                f"[{self.name}] Planner generated an empty plan. Nothing to execute."
+            if plan is None:
+                logger.error(f"[{self.name}] No usable plan. Aborting workflow.")
+                emit("error", message="The planner did not produce a usable plan.")
+                return
+            emit("plan", source=attrs["mode"], steps=plan.model_dump()["steps"])
+
+            logger.info(
+                f"[{self.name}] Planning complete. Generated a plan with {len(plan.steps)} steps."
+            )
+            cache_key = (
+                plan_cache.put(user_id, user_query, plan.model_dump())
+                if user_query
+                else None
             )
+
+        # --- 2. Execution Phase ---
+        logger.info(f"[{self.name}] Starting execution of the plan...")
+        branches = self._branches(plan.steps, len(trace))
+        serial_end = branches[0][0] if branches else len(plan.steps)
+        async for event in self._execute(
+            ctx, plan.steps, len(trace), serial_end, trace
+        ):
+            yield event
+        if branches and len(trace) == serial_end:
+            async for event in self._run_branches(ctx, plan.steps, branches, trace):
+                yield event
+
+        if len(trace) < len(plan.steps):
+            if cache_key:
+                plan_cache.invalidate(cache_key)
+            if macro:
+                macro_store.invalidate(user_id, user_query)
             return
 
         logger.info(
-            f"[{self.name}] Planning complete. Generated a plan with {len(plan.steps)} steps."
+            f"[{self.name}] Workflow finished successfully. All {len(plan.steps)} steps executed."
         )
+        if user_query:
+            macro_store.put(user_id, user_query, trace)
 
-        # --- 2. Execution Phase (Runs Sequentially) ---
-        logger.info(f"[{self.name}] Starting execution of the plan...")
-        for i, step in enumerate(plan.steps):
+    async def _execute(
+        self,
+        ctx: InvocationContext,
+        steps: list,
+        start: int,
+        end: int,
+        trace: list,
+        label: str | None = None,
+    ) -> AsyncGenerator[Event, None]:
+        """
+        Runs steps[start:end] in order on the current browser, appending each
+        completed step to `trace`. Stops at the first step that fails.
+        """
+        name = f"{self.name}:{label}" if label else self.name
+        # Steps before this index have their fields resolved in one batch.
+        batch_end = start
+        for i in range(start, end):
+            step = steps[i]
+            if i >= batch_end:
+                ctx.session.state["batch_resolutions"] = {}
+                batch = self._form_fill_run(steps[:end], i)
+                if len(batch) > 1:
+                    batch_end = i + len(batch)
+                    ctx.session.state["form_fill_steps"] = batch
+                    logger.info(
+                        f"[{name}] Resolving fields for steps {i + 1}-{batch_end} in one batch."
+                    )
+                    async for event in self.form_fill_agent.run_async(ctx):
+                        yield event
             current_step_number = i + 1
+            next_action = steps[i + 1].action_type if i + 1 < end else None
             ctx.session.state["current_step"] = step.model_dump()
+            ctx.session.state["current_step_index"] = i
+            ctx.session.state["page_fingerprint"] = None
+            ctx.session.state["performed_element"] = None
             logger.info(
-                f"[{self.name}] Executing Step {current_step_number}/{len(plan.steps)}: {step.action_type}"
+                f"[{name}] Executing Step {current_step_number}/{len(steps)}: {step.action_type}"
+            )
+            emit(
+                "step_started",
+                step=current_step_number,
+                total=len(steps),
+                branch=label,
+                action=step.model_dump(),
             )
+            started = time.monotonic()
 
-            async for event in self.execution_agent.run_async(ctx):
-                yield event
+            try:
+                with span("aurora_step_seconds", action_type=step.action_type) as attrs:
+                    attrs["step"] = current_step_number
+                    if label:
+                        attrs["branch"] = label
+                    async for event in self.execution_agent.run_async(ctx):
+                        self._prefetch_for_next(event, next_action)
+                        yield event
+                    attrs["succeeded"] = bool(
+                        ctx.session.state.get("execution_succeeded")
+                    )
+            except asyncio.CancelledError:
+                skipped = end - current_step_number
+                logger.warning(
+                    f"[{name}] Run cancelled during step {current_step_number}/{len(steps)}; "
+                    f"skipped {skipped} remaining steps (at least {skipped} model calls)."
+                )
+                raise
 
-            if not ctx.session.state.get("execution_succeeded"):
+            succeeded = bool(ctx.session.state.get("execution_succeeded"))
+            emit(
+                "step_finished",
+                step=current_step_number,
+                branch=label,
+                succeeded=succeeded,
+                seconds=round(time.monotonic() - started, 3),
+                error=None if succeeded else ctx.session.state.get("execution_error"),
+            )
+            if not succeeded:
                 error_message = ctx.session.state.get(
                     "execution_error", "Unknown execution failure."
                 )
                 logger.error(
-                    f"[{self.name}] Step {current_step_number} failed: {error_message}. Halting workflow."
+                    f"[{name}] Step {current_step_number} failed: {error_message}. Halting workflow."
                 )
                 return
 
-            logger.info(
-                f"[{self.name}] Step {current_step_number} completed successfully."
-            )
+            trace.append(self._trace_entry(ctx))
+            logger.info(f"[{name}] Step {current_step_number} completed successfully.")
 
+    async def _run_branches(
+        self,
+        ctx: InvocationContext,
+        steps: list,
+        branches: list[tuple[int, int]],
+        trace: list,
+    ) -> AsyncGenerator[Event, None]:
+        """
+        Runs independent sub-tasks concurrently, at most MAX_PARALLEL_BRANCHES
+        at a time. The first keeps the current page and the others each get a
+        new tab. Every sub-task works on its own fork of the session, and how
+        each went is merged into state["branch_results"].
+        """
+        browser = current_browser()
+        labels = self._branch_labels(steps, branches)
         logger.info(
-            f"[{self.name}] Workflow finished successfully. All {len(plan.steps)} steps executed."
+            f"[{self.name}] Running {len(branches)} sub-tasks in parallel: {', '.join(labels)}"
+        )
+        forks = [self._fork(ctx, label) for label in labels]
+        traces: list[list] = [[] for _ in branches]
+        urls: list[str | None] = [None] * len(branches)
+        events: asyncio.Queue = asyncio.Queue()
+        limit = asyncio.Semaphore(MAX_PARALLEL_BRANCHES)
+
+        async def run(index: int):
+            start, end = branches[index]
+            fork = forks[index]
+            try:
+                async with limit:
+                    tab = browser if index == 0 else await browser.new_tab()
+                    try:
+                        with use_browser(tab):
+                            async for event in self._execute(
+                                fork, steps, start, end, traces[index], labels[index]
+                            ):
+                                self._apply(fork.session, event)
+                                await events.put(self._without_state(event))
+                        urls[index] = tab.page.url if tab.page else None
+                    finally:
+                        if tab is not browser:
+                            await tab.close()
+            except Exception as e:
+                logger.error(f"[{self.name}:{labels[index]}] Sub-task crashed: {e}")
+                emit("error", branch=labels[index], message=str(e))
+                fork.session.state["execution_error"] = str(e)
+            finally:
+                events.put_nowait(None)
+
+        tasks = [asyncio.create_task(run(index)) for index in range(len(branches))]
+        try:
+            finished = 0
+            while finished < len(tasks):
+                event = await events.get()
+                if event is None:
+                    finished += 1
+                    continue
+                yield event
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        results = {}
+        for index, (start, end) in enumerate(branches):
+            succeeded = len(traces[index]) == end - start
+            results[labels[index]] = {
+                "succeeded": succeeded,
+                "steps_completed": len(traces[index]),
+                "steps": end - start,
+                "url": urls[index],
+                "error": (
+                    None
+                    if succeeded
+                    else forks[index].session.state.get("execution_error")
+                ),
+            }
+        ctx.session.state["branch_results"] = results
+
+        failed = [label for label, result in results.items() if not result["succeeded"]]
+        if failed:
+            ctx.session.state["execution_succeeded"] = False
+            ctx.session.state["execution_error"] = (
+                f"Sub-tasks failed: {', '.join(failed)}."
+            )
+            logger.error(
+                f"[{self.name}] {len(failed)} of {len(branches)} sub-tasks failed: {', '.join(failed)}."
+            )
+            return
+        # Recorded in plan order, so the macro replays the sub-tasks one by one.
+        for branch_trace in traces:
+            trace.extend(branch_trace)
+        ctx.session.state["execution_succeeded"] = True
+
+    def _branches(self, steps: list, start: int) -> list[tuple[int, int]]:
+        """
+        The (start, end) of every parallel sub-task from `start` on, or an
+        empty list if fewer than two sub-tasks are left to run.
+        """
+        starts = [
+            i
+            for i in range(start, len(steps))
+            if steps[i].action_type == "navigate" and steps[i].branch
+        ]
+        if len(starts) < 2:
+            return []
+        return list(zip(starts, starts[1:] + [len(steps)]))
+
+    def _branch_labels(self, steps: list, branches: list[tuple[int, int]]) -> list:
+        labels = []
+        for index, (start, _) in enumerate(branches):
+            label = steps[start].branch
+            labels.append(label if label not in labels else f"{label}_{index + 1}")
+        return labels
+
+    def _fork(self, ctx: InvocationContext, label: str) -> InvocationContext:
+        """A context whose session state and history a sub-task can change alone."""
+        session = ctx.session.model_copy(
+            update={
+                "state": dict(ctx.session.state),
+                "events": list(ctx.session.events),
+            }
         )
+        fork = ctx.model_copy(update={"session": session})
+        fork.branch = f"{ctx.branch or self.name}.{label}"
+        return fork
+
+    @staticmethod
+    def _apply(session, event: Event):
+        """What the runner does with an event, done on a sub-task's forked session."""
+        if event.partial:
+            return
+        if event.actions and event.actions.state_delta:
+            for key, value in event.actions.state_delta.items():
+                if not key.startswith("temp:"):
+                    session.state[key] = value
+        session.events.append(event)
+
+    @staticmethod
+    def _without_state(event: Event) -> Event:
+        # Sibling sub-tasks write the same keys; what they write stays on
+        # their own fork instead of racing in the shared session.
+        if not event.actions or not event.actions.state_delta:
+            return event
+        return event.model_copy(
+            update={"actions": event.actions.model_copy(update={"state_delta": {}})}
+        )
+
+    def _planned(self, ctx: InvocationContext) -> Plan | None:
+        """The plan the planning agent left in state, if it is valid and not empty."""
+        plan_output = ctx.session.state.get("plan")
+
+        if not plan_output or not isinstance(plan_output, dict):
+            logger.error(
+                f"[{self.name}] Planning agent did not produce a valid plan object."
+            )
+            return None
+
+        try:
+            plan = Plan.model_validate(plan_output)
+        except Exception as e:
+            logger.error(f"[{self.name}] Failed to validate the plan structure: {e}.")
+            return None
+
+        if not plan.steps:
+            logger.warning(f"[{self.name}] Planner generated an empty plan.")
+            return None
+        return plan
+
+    async def _replay(
+        self, ctx: InvocationContext, macro: list, trace: list
+    ) -> AsyncGenerator[Event, None]:
+        """Replays recorded steps until one fails or no longer matches the page."""
+        for i, entry in enumerate(macro):
+            next_action = (
+                macro[i + 1]["step"]["action_type"] if i + 1 < len(macro) else None
+            )
+            emit(
+                "step_started",
+                step=i + 1,
+                total=len(macro),
+                branch=None,
+                action=entry["step"],
+                replayed=True,
+            )
+            started = time.monotonic()
+            async for event in replay_step(ctx, self.name, entry):
+                self._prefetch_for_next(event, next_action)
+                yield event
+            succeeded = bool(ctx.session.state.get("execution_succeeded"))
+            emit(
+                "step_finished",
+                step=i + 1,
+                branch=None,
+                succeeded=succeeded,
+                seconds=round(time.monotonic() - started, 3),
+                # A replay that stops early hands over to the agents.
+                error=None if succeeded else ctx.session.state.get("execution_error"),
+                replayed=True,
+            )
+            if not succeeded:
+                return
+            trace.append(entry)
+
+    def _prefetch_for_next(self, event: Event, next_action: str | None):
+        """
+        Once a step's action has returned, starts scanning the page for the
+        next step if it is an interaction, overlapping the scan with whatever
+        the current step still does (usually the decision agent's closing
+        model call).
+        """
+        if next_action == "interact" and event.get_function_responses():
+            current_browser().prefetch_elements()
+
+    def _form_fill_run(self, steps: list, start: int) -> list:
+        """The consecutive type steps starting at `start`, with their indexes."""
+        run = []
+        for index in range(start, len(steps)):
+            step = steps[index]
+            if step.action_type != "interact" or step.interaction_type != "type":
+                break
+            run.append({"index": index, "step": step.model_dump()})
+        return run
+
+    def _trace_entry(self, ctx: InvocationContext) -> dict:
+        state = ctx.session.state
+        entry = {"step": state["current_step"]}
+        if state["current_step"]["action_type"] == "interact":
+            entry["fingerprint"] = state.get("page_fingerprint")
+            entry["element"] = state.get("performed_element")
+        return entry
+
+    def _recorded_macro(self, user_id: str, user_query: str | None) -> list | None:
+        if not user_query:
+            return None
+        macro = macro_store.get(user_id, user_query)
+        if not macro:
+            return None
+        try:
+            Plan.model_validate({"steps": [entry["step"] for entry in macro]})
+        except Exception as e:
+            logger.warning(
+                f"[{self.name}] Discarding recorded macro that no longer validates: {e}"
+            )
+            macro_store.invalidate(user_id, user_query)
+            return None
+        return macro
+
+    def _user_query(self, ctx: InvocationContext) -> str | None:
+        if ctx.user_content and ctx.user_content.parts:
+            text = "".join(part.text or "" for part in ctx.user_content.parts)
+            if text.strip():
+                return text
+        return ctx.session.state.get("user_query")
+
+    def _cached_plan(
+        self, user_id: str, user_query: str | None
+    ) -> tuple[str, Plan] | None:
+        if not user_query:
+            return None
+        cached = plan_cache.get(user_id, user_query)
+        if not cached:
+            return None
+        cache_key, plan_output = cached
+        try:
+            plan = Plan.model_validate(plan_output)
+        except Exception as e:
+            logger.warning(
+                f"[{self.name}] Discarding cached plan that no longer validates: {e}"
+            )
+            plan_cache.invalidate(cache_key)
+            return None
+        return cache_key, plan
 
 
 root_agent = RootAgent(
     name="AuroraRootAgent",
     planning_agent=planning_agent,
     execution_agent=execution_agent,
+    form_fill_agent=form_fill_agent,
+    fast_planning_agent=fast_planning_agent if PLANNING_MODE == "fast" else None,
 )
+instrument_agents(root_agent)
 
 __all__ = ["root_agent"]
@@ -1,24 +1,329 @@
 import logging
-from typing import AsyncGenerator
+from typing import AsyncGenerator, List
 
-from google.adk.agents import BaseAgent, LlmAgent, SequentialAgent
+from google.adk.agents import BaseAgent, LlmAgent
 from google.adk.agents.invocation_context import InvocationContext
 from google.adk.events import Event
+from google.adk.flows.llm_flows.functions import generate_client_function_call_id
 from google.adk.tools import FunctionTool
+from google.genai import types
+from pydantic import BaseModel, Field, ValidationError
 from typing_extensions import override
 
-from browser_manager import browser_manager
+from browser_manager import current_browser
+from decision_cache import (
+    decision_cache,
+    element_signature,
+    page_fingerprint,
+    resolve_signature,
+)
+from element_ranking import confident_match, rank_elements
+
+from .planning_agent import NavigateAction
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# How many of the best locally ranked elements a decision agent gets to see.
+CANDIDATES_PER_DECISION = 8
+# Below this top score the ranking says little about the target, so the
+# decision agent sees every element, up to the token budget, instead.
+WEAK_RANKING_SCORE = 1.0
+
 
 # --- Tool Definitions ---
-# All browser interactions are defined as tools for the LLM agents.
+# All browser interactions are defined as tools for the LLM agents. They act on
+# the browser leased to the current run rather than on any fixed page.
+
+
+async def navigate(url: str):
+    return await current_browser().navigate(url)
+
+
+async def click_element(element_id: int):
+    return await current_browser().click_element(element_id)
+
+
+async def type_into_element(element_id: int, text_to_type: str, submit: bool = False):
+    return await current_browser().type_into_element(element_id, text_to_type, submit)
+
+
+navigate_tool = FunctionTool(func=navigate)
+click_element_tool = FunctionTool(func=click_element)
+type_into_element_tool = FunctionTool(func=type_into_element)
+
+
+async def call_tool_directly(
+    ctx: InvocationContext, author: str, tool: FunctionTool, args: dict
+) -> AsyncGenerator[Event, None]:
+    """
+    Runs a tool without a model deciding to call it, emitting the same
+    function call and response events an LlmAgent would have produced.
+    """
+    function_call = types.FunctionCall(
+        id=generate_client_function_call_id(), name=tool.name, args=args
+    )
+    yield Event(
+        invocation_id=ctx.invocation_id,
+        author=author,
+        branch=ctx.branch,
+        content=types.Content(
+            role="model", parts=[types.Part(function_call=function_call)]
+        ),
+    )
+
+    try:
+        result = await tool.func(**args) or {}
+    except Exception as e:
+        raise RuntimeError(f"Tool '{tool.name}' failed: {e}")
+    if not isinstance(result, dict):
+        # Same wrapping the ADK applies to non-dict tool results.
+        result = {"result": result}
+
+    function_response = types.FunctionResponse(
+        id=function_call.id, name=tool.name, response=result
+    )
+    yield Event(
+        invocation_id=ctx.invocation_id,
+        author=author,
+        branch=ctx.branch,
+        content=types.Content(
+            role="user", parts=[types.Part(function_response=function_response)]
+        ),
+    )
+
+
+def decision_candidates(elements: list, ranked: list) -> list:
+    """The best ranked elements, or all of them in page order if the ranking is weak."""
+    if not ranked or ranked[0][0] < WEAK_RANKING_SCORE:
+        return list(elements)
+    return [element for _, element in ranked[:CANDIDATES_PER_DECISION]]
+
+
+def store_candidates(ctx: InvocationContext, state_key: str, elements: list) -> int:
+    """
+    Ranks the fetched elements against the current step and keeps only the
+    best few for the decision agent, see `decision_candidates`. If the element can be resolved without
+    the decision agent, its id is stored under `resolved_element_id` and the
+    way it was resolved under `resolved_by`. Returns the number of candidates
+    kept.
+    """
+    state = ctx.session.state
+    description = state["current_step"].get("element_description") or ""
+    ranked = rank_elements(elements, description)
+    candidates = decision_candidates(elements, ranked)
+    browser = current_browser()
+    state[state_key] = browser.format_elements_for_llm(
+        candidates, token_budget=browser.ELEMENT_TOKEN_BUDGET
+    )
+
+    fingerprint = page_fingerprint(browser.page.url, state_key, elements)
+    state["page_fingerprint"] = fingerprint
+    batched = (state.get("batch_resolutions") or {}).get(
+        str(state.get("current_step_index"))
+    )
+    if batched and any(el["id"] == batched["id"] for el in elements):
+        element_id, source = batched["id"], batched["source"]
+    else:
+        match, source = resolve_locally(fingerprint, description, elements, ranked)
+        element_id = match["id"] if match else None
+    state["resolved_element_id"] = element_id
+    state["resolved_by"] = source
+    return len(candidates)
+
+
+def resolve_locally(
+    fingerprint: str, description: str, elements: list, ranked: list
+) -> tuple[dict | None, str | None]:
+    """
+    Resolves an element without a model: an earlier decision on the same kind
+    of page that still matches exactly one element, else an unambiguous
+    ranking winner. Returns the element and "cache" or "ranking", or
+    (None, None).
+    """
+    signature = decision_cache.get(fingerprint, description)
+    if signature:
+        match = resolve_signature(signature, elements)
+        if match:
+            return match, "cache"
+        decision_cache.invalidate(fingerprint, description)
+    match = confident_match(ranked)
+    return (match, "ranking") if match else (None, None)
+
+
+def _tool_succeeded(response: types.FunctionResponse) -> bool:
+    result = (response.response or {}).get("result", "")
+    return isinstance(result, str) and result.startswith("Successfully")
+
+
+class InteractSequence(BaseAgent):
+    """
+    Fetches candidate elements, then performs the interaction on the element
+    resolved without a model or, if there is none or the interaction fails,
+    lets the decision agent choose. Successful model choices are remembered
+    in the decision cache.
+    """
+
+    fetcher: BaseAgent
+    decision_agent: LlmAgent
+    tool: FunctionTool
+    # The tool argument that receives the step's `value`, if any.
+    value_arg: str | None = None
+
+    model_config = {"arbitrary_types_allowed": True}
+
+    def __init__(
+        self,
+        name: str,
+        fetcher: BaseAgent,
+        decision_agent: LlmAgent,
+        tool: FunctionTool,
+        **kwargs,
+    ):
+        super().__init__(
+            name=name,
+            fetcher=fetcher,
+            decision_agent=decision_agent,
+            tool=tool,
+            sub_agents=[fetcher, decision_agent],
+            **kwargs,
+        )
+
+    @override
+    async def _run_async_impl(
+        self, ctx: InvocationContext
+    ) -> AsyncGenerator[Event, None]:
+        async for event in self.fetcher.run_async(ctx):
+            yield event
+
+        state = ctx.session.state
+        fingerprint = state.get("page_fingerprint")
+        description = state["current_step"].get("element_description") or ""
+        element_id = state.get("resolved_element_id")
+        if element_id is None:
+            async for event in self._decide(ctx):
+                yield event
+            return
+
+        source = state.get("resolved_by")
+        logger.info(
+            f"[{self.name}] Element {element_id} resolved by {source}; skipping {self.decision_agent.name}."
+        )
+        args = {"element_id": element_id}
+        if self.value_arg:
+            args[self.value_arg] = state["current_step"].get("value") or ""
+        error = None
+        async for event in call_tool_directly(ctx, self.name, self.tool, args):
+            for response in event.get_function_responses():
+                if _tool_succeeded(response):
+                    # Batched choices came from a model, so they are worth keeping.
+                    self._record(ctx, element_id, remember=source == "batch")
+                else:
+                    error = (response.response or {}).get("result")
+            yield event
+        if error is None:
+            return
+
+        if source == "cache":
+            decision_cache.invalidate(fingerprint, description)
+        logger.warning(
+            f"[{self.name}] Element {element_id} from {source} failed ({error}); asking {self.decision_agent.name}."
+        )
+        async for event in self._decide(ctx):
+            yield event
+
+    async def _decide(self, ctx: InvocationContext) -> AsyncGenerator[Event, None]:
+        chosen_id = None
+        async for event in self.decision_agent.run_async(ctx):
+            for call in event.get_function_calls():
+                if call.name == self.tool.name:
+                    chosen_id = (call.args or {}).get("element_id")
+            for response in event.get_function_responses():
+                if response.name == self.tool.name and _tool_succeeded(response):
+                    self._record(ctx, chosen_id, remember=True)
+            yield event
+
+    def _record(self, ctx: InvocationContext, element_id, remember: bool):
+        """
+        Stores the signature of the element acted on under `performed_element`
+        and, for choices made by the decision agent, in the decision cache.
+        """
+        element = _find_element(element_id)
+        if element is None:
+            return
+        state = ctx.session.state
+        signature = element_signature(element)
+        state["performed_element"] = signature
+        if remember and state.get("page_fingerprint"):
+            description = state["current_step"].get("element_description") or ""
+            decision_cache.put(state["page_fingerprint"], description, signature)
+            logger.info(
+                f"[{self.name}] Cached decision for '{description}': {decision_cache.stats()}"
+            )
+
+
+def _find_element(element_id) -> dict | None:
+    browser = current_browser()
+    return next(
+        (
+            el
+            for el in browser.clickable_elements + browser.form_elements
+            if el["id"] == element_id
+        ),
+        None,
+    )
+
 
-navigate_tool = FunctionTool(func=browser_manager.navigate)
-click_element_tool = FunctionTool(func=browser_manager.click_element)
-type_into_element_tool = FunctionTool(func=browser_manager.type_into_element)
+async def replay_step(
+    ctx: InvocationContext, author: str, recorded: dict
+) -> AsyncGenerator[Event, None]:
+    """
+    Performs one step of a recorded macro straight through the browser,
+    without any model calls. An interaction is only replayed if the page
+    still has the recorded fingerprint and exactly one element matches the
+    recorded signature. Sets `execution_succeeded` like ExecutionAgent.
+    """
+    state = ctx.session.state
+    step = recorded["step"]
+    state["current_step"] = step
+    state["execution_succeeded"] = False
+    state["execution_error"] = None
+
+    if step["action_type"] == "navigate":
+        tool, args = navigate_tool, {"url": step["url"]}
+    else:
+        browser = current_browser()
+        await browser.scan_elements()
+        if step["interaction_type"] == "click":
+            state_key, elements = "clickable_elements", browser.clickable_elements
+            tool, value_arg = click_element_tool, None
+        else:
+            state_key, elements = "form_elements", browser.form_elements
+            tool, value_arg = type_into_element_tool, "text_to_type"
+
+        if page_fingerprint(browser.page.url, state_key, elements) != recorded.get(
+            "fingerprint"
+        ):
+            state["execution_error"] = "Page does not match the recorded checkpoint."
+            return
+        element = resolve_signature(recorded.get("element") or {}, elements)
+        if element is None:
+            state["execution_error"] = "Recorded element not found on the page."
+            return
+        args = {"element_id": element["id"]}
+        if value_arg:
+            args[value_arg] = step.get("value") or ""
+
+    try:
+        async for event in call_tool_directly(ctx, author, tool, args):
+            for response in event.get_function_responses():
+                if tool is navigate_tool or _tool_succeeded(response):
+                    state["execution_succeeded"] = True
+                else:
+                    state["execution_error"] = response.response.get("result")
+            yield event
+    except RuntimeError as e:
+        state["execution_error"] = str(e)
 
 
 # --- AGENT DEFINITIONS FOR 'NAVIGATE' ACTION ---
@@ -49,12 +354,11 @@ class ClickableElementsFetcher(BaseAgent):
         self, ctx: InvocationContext
     ) -> AsyncGenerator[Event, None]:
         logger.info(f"[{self.name}] Fetching all clickable elements from the page...")
-        elements_data = await browser_manager.get_clickable_elements()
-        ctx.session.state["clickable_elements"] = elements_data.get(
-            "clickable_elements", []
-        )
+        browser = current_browser()
+        await browser.get_clickable_elements()
+        kept = store_candidates(ctx, "clickable_elements", browser.clickable_elements)
         logger.info(
-            f"[{self.name}] Found {len(ctx.session.state['clickable_elements'])} clickable elements."
+            f"[{self.name}] Found {len(browser.clickable_elements)} clickable elements, kept {kept} candidates."
         )
         if False:
             yield
@@ -65,28 +369,27 @@ click_decision_agent = LlmAgent(
     model="gemini-2.0-flash",
     instruction="""
     You are a web interaction specialist. Your goal is to click an element.
-    You have been given a command and a list of available elements from the webpage.
+    You have been given a command and the best candidate elements from the webpage, most likely first.
 
     **Command:**
     Click the element described as: "{{current_step.element_description}}"
 
-    **Available Clickable Elements (JSON):**
+    **Candidate Clickable Elements (one per element, `#id` first):**
     {{clickable_elements}}
 
     **Your Task:**
     1.  Analyze the list of elements.
     2.  Find the ONE element that is the best match for the command.
-    3.  Call the `click_element` tool with the `id` of your chosen element.
+    3.  Call the `click_element` tool with the numeric `id` of your chosen element.
     """,
     tools=[click_element_tool],
 )
 
-click_sequence_agent = SequentialAgent(
+click_sequence_agent = InteractSequence(
     name="ClickSequence",
-    sub_agents=[
-        ClickableElementsFetcher(name="ClickableElementsFetcher"),
-        click_decision_agent,
-    ],
+    fetcher=ClickableElementsFetcher(name="ClickableElementsFetcher"),
+    decision_agent=click_decision_agent,
+    tool=click_element_tool,
 )
 
 
@@ -101,10 +404,11 @@ class FormElementsFetcher(BaseAgent):
         self, ctx: InvocationContext
     ) -> AsyncGenerator[Event, None]:
         logger.info(f"[{self.name}] Fetching all form elements from the page...")
-        elements_data = await browser_manager.get_form_elements()
-        ctx.session.state["form_elements"] = elements_data.get("form_elements", [])
+        browser = current_browser()
+        await browser.get_form_elements()
+        kept = store_candidates(ctx, "form_elements", browser.form_elements)
         logger.info(
-            f"[{self.name}] Found {len(ctx.session.state['form_elements'])} form elements."
+            f"[{self.name}] Found {len(browser.form_elements)} form elements, kept {kept} candidates."
         )
         if False:
             yield
@@ -115,27 +419,162 @@ type_decision_agent = LlmAgent(
     model="gemini-2.0-flash",
     instruction="""
     You are a data entry specialist. Your goal is to type text into a form field.
-    You have been given a command and a list of available form elements.
+    You have been given a command and the best candidate form elements, most likely first.
 
     **Command:**
     In the element described as "{{current_step.element_description}}", type the value "{{current_step.value}}"
 
-    **Available Form Elements (JSON):**
+    **Candidate Form Elements (one per element, `#id` first):**
     {{form_elements}}
 
     **Your Task:**
     1.  Analyze the list of elements to find the best match for the command.
-    2.  Call the `type_into_element` tool with the `id` of your chosen element and the `text` value from the command.
+    2.  Call the `type_into_element` tool with the numeric `id` of your chosen element and the `text` value from the command.
     """,
     tools=[type_into_element_tool],
 )
 
-type_sequence_agent = SequentialAgent(
+type_sequence_agent = InteractSequence(
     name="TypeSequence",
-    sub_agents=[
-        FormElementsFetcher(name="FormElementsFetcher"),
-        type_decision_agent,
-    ],
+    fetcher=FormElementsFetcher(name="FormElementsFetcher"),
+    decision_agent=type_decision_agent,
+    tool=type_into_element_tool,
+    value_arg="text_to_type",
+)
+
+
+# --- AGENT DEFINITIONS FOR BATCHED 'TYPE' STEPS ---
+
+
+class FieldChoice(BaseModel):
+    field: int = Field(description="The number of the field in the list.")
+    element_id: int = Field(description="The id of the element to type into.")
+
+
+class FormFillChoices(BaseModel):
+    choices: List[FieldChoice]
+
+
+class FormFillResolver(BaseAgent):
+    """
+    Resolves the target fields of several consecutive type steps against one
+    form-element snapshot, asking the decision agent once for all fields that
+    could not be resolved locally. The results go into `batch_resolutions`,
+    keyed by plan step index, where the TypeSequence of each step picks them
+    up; the steps themselves still run one by one.
+
+    Resolving is only a shortcut: if it fails, `batch_resolutions` is left
+    empty and every step resolves its own field.
+    """
+
+    decision_agent: LlmAgent
+
+    model_config = {"arbitrary_types_allowed": True}
+
+    def __init__(self, name: str, decision_agent: LlmAgent, **kwargs):
+        super().__init__(
+            name=name,
+            decision_agent=decision_agent,
+            sub_agents=[decision_agent],
+            **kwargs,
+        )
+
+    @override
+    async def _run_async_impl(
+        self, ctx: InvocationContext
+    ) -> AsyncGenerator[Event, None]:
+        ctx.session.state["batch_resolutions"] = {}
+        try:
+            async for event in self._resolve(ctx):
+                yield event
+        except Exception as e:
+            # A model error or output ADK could not parse as FormFillChoices.
+            logger.warning(
+                f"[{self.name}] Batch resolution failed ({e}); each step resolves its own field."
+            )
+            ctx.session.state["batch_resolutions"] = {}
+
+    async def _resolve(self, ctx: InvocationContext) -> AsyncGenerator[Event, None]:
+        state = ctx.session.state
+        # [{"index": plan step index, "step": step dict}, ...]
+        steps = state["form_fill_steps"]
+        browser = current_browser()
+        await browser.get_form_elements()
+        elements = browser.form_elements
+        fingerprint = page_fingerprint(browser.page.url, "form_elements", elements)
+
+        resolutions, unresolved, candidates = {}, [], {}
+        for entry in steps:
+            description = entry["step"].get("element_description") or ""
+            ranked = rank_elements(elements, description)
+            match, source = resolve_locally(fingerprint, description, elements, ranked)
+            if match:
+                resolutions[str(entry["index"])] = {"id": match["id"], "source": source}
+                continue
+            unresolved.append(entry)
+            for element in decision_candidates(elements, ranked):
+                candidates.setdefault(element["id"], element)
+
+        if unresolved:
+            state["form_fill_fields"] = "\n".join(
+                f'{number}. "{entry["step"].get("element_description")}" <- "{entry["step"].get("value") or ""}"'
+                for number, entry in enumerate(unresolved, start=1)
+            )
+            state["form_elements"] = browser.format_elements_for_llm(
+                list(candidates.values()), token_budget=browser.ELEMENT_TOKEN_BUDGET
+            )
+            state["form_fill_choices"] = None
+            async for event in self.decision_agent.run_async(ctx):
+                yield event
+            try:
+                choices = FormFillChoices.model_validate(
+                    state.get("form_fill_choices") or {}
+                ).choices
+            except ValidationError as e:
+                logger.warning(f"[{self.name}] Ignoring malformed field choices: {e}")
+                choices = []
+            for choice in choices:
+                if (
+                    1 <= choice.field <= len(unresolved)
+                    and choice.element_id in candidates
+                ):
+                    index = unresolved[choice.field - 1]["index"]
+                    resolutions[str(index)] = {
+                        "id": choice.element_id,
+                        "source": "batch",
+                    }
+
+        state["batch_resolutions"] = resolutions
+        logger.info(
+            f"[{self.name}] Resolved {len(resolutions)}/{len(steps)} fields with {1 if unresolved else 0} model call(s)."
+        )
+
+
+form_fill_decision_agent = LlmAgent(
+    name="FormFillDecisionAgent",
+    model="gemini-2.0-flash",
+    instruction="""
+    You are a data entry specialist. Several fields of a form need to be filled in.
+    Match every field below to the form element it describes.
+
+    **Fields (number. "description" <- value):**
+    {{form_fill_fields}}
+
+    **Candidate Form Elements (one per element, `#id` first):**
+    {{form_elements}}
+
+    **Your Task:**
+    For each field, choose the ONE element that best matches its description and
+    return its number with the numeric `id` of that element. Use each element at most once.
+    """,
+    output_schema=FormFillChoices,
+    output_key="form_fill_choices",
+    disallow_transfer_to_parent=True,
+    disallow_transfer_to_peers=True,
+)
+
+form_fill_agent = FormFillResolver(
+    name="FormFillResolver", decision_agent=form_fill_decision_agent
 )
 
 
@@ -147,8 +586,8 @@ class ExecutionAgent(BaseAgent):
     """
 
     navigate_worker: LlmAgent
-    click_sequence: SequentialAgent
-    type_sequence: SequentialAgent
+    click_sequence: InteractSequence
+    type_sequence: InteractSequence
 
     model_config = {"arbitrary_types_allowed": True}
 
@@ -156,8 +595,8 @@ class ExecutionAgent(BaseAgent):
         self,
         name: str,
         navigate_worker: LlmAgent,
-        click_sequence: SequentialAgent,
-        type_sequence: SequentialAgent,
+        click_sequence: InteractSequence,
+        type_sequence: InteractSequence,
         **kwargs,
     ):
         super().__init__(
@@ -185,8 +624,13 @@ class ExecutionAgent(BaseAgent):
             logger.info(f"[{self.name}] Dispatching action: '{action_type}'")
 
             agent_to_run = None
+            events = None
             if action_type == "navigate":
-                agent_to_run = self.navigate_worker
+                try:
+                    step = NavigateAction.model_validate(current_step)
+                    events = self._navigate_directly(ctx, step)
+                except ValidationError:
+                    agent_to_run = self.navigate_worker
             elif action_type == "interact":
                 interaction_type = current_step.get("interaction_type")
                 if interaction_type == "click":
@@ -198,8 +642,13 @@ class ExecutionAgent(BaseAgent):
             else:
                 raise ValueError(f"Unknown action type: '{action_type}'")
 
+            if events is None:
+                events = agent_to_run.run_async(ctx)
+
             tool_was_called = False
-            async for event in agent_to_run.run_async(ctx):
+            # The last click or type result; an earlier failure may have been retried.
+            interaction = None
+            async for event in events:
                 if event.get_function_calls():
                     tool_was_called = True
                     logger.info(
@@ -210,13 +659,23 @@ class ExecutionAgent(BaseAgent):
                     logger.info(
                         f"[{self.name}] Detected function_responses: {event.get_function_responses()}"
                     )
+                    for response in event.get_function_responses():
+                        if response.name != navigate_tool.name:
+                            interaction = response
 
                 yield event
 
             if not tool_was_called:
                 raise RuntimeError(
-                    f"The agent '{agent_to_run.name}' completed without calling its required tool."
+                    f"The agent '{agent_to_run.name if agent_to_run else self.name}' completed without calling its required tool."
                 )
+            if action_type == "interact" and (
+                interaction is None or not _tool_succeeded(interaction)
+            ):
+                result = (
+                    (interaction.response or {}).get("result") if interaction else None
+                )
+                raise RuntimeError(f"The interaction did not succeed: {result}")
 
             logger.info(f"[{self.name}] Successfully executed action: '{action_type}'")
             ctx.session.state["execution_succeeded"] = True
@@ -232,6 +691,19 @@ class ExecutionAgent(BaseAgent):
                 "An unexpected system error occurred."
             )
 
+    async def _navigate_directly(
+        self, ctx: InvocationContext, step: NavigateAction
+    ) -> AsyncGenerator[Event, None]:
+        """
+        Performs a navigate step without asking a model to copy the URL into a
+        tool call.
+        """
+        logger.info(f"[{self.name}] Navigating directly to {step.url}")
+        async for event in call_tool_directly(
+            ctx, self.name, navigate_tool, {"url": step.url}
+        ):
+            yield event
+
 
 # --- Instantiation Block ---
 execution_agent = ExecutionAgent(
@@ -1,8 +1,15 @@
-from google.adk.agents import SequentialAgent, LlmAgent
+import logging
+import re
+from typing import AsyncGenerator, List
+
+from google.adk.agents import BaseAgent, LlmAgent, SequentialAgent
+from google.adk.agents.invocation_context import InvocationContext
+from google.adk.events import Event
 from google.adk.tools import google_search
 from pydantic import BaseModel, Field
-from typing_extensions import Literal, Union
-from typing import List
+from typing_extensions import Literal, Union, override
+
+logger = logging.getLogger(__name__)
 
 
 class NavigateAction(BaseModel):
@@ -10,6 +17,16 @@ class NavigateAction(BaseModel):
 
     action_type: Literal["navigate"] = "navigate"
     url: str = Field(description="The full URL to navigate to.")
+    branch: str | None = Field(
+        default=None,
+        description=(
+            "Set only when this navigation starts an independent sub-task, such as "
+            "one site in a price comparison: a short label for the sub-task. The "
+            "sub-task runs up to the next navigate step with a branch label, and "
+            "consecutive sub-tasks run in parallel in separate tabs, so they must "
+            "come last in the plan."
+        ),
+    )
 
 
 class InteractAction(BaseModel):
@@ -83,6 +100,7 @@ planning_generator_agent = LlmAgent(
     5.  Be extremely descriptive for `interact` steps. Instead of "search bar", say "the search input field with the placeholder text 'Search Wikipedia'".
     6.  The plan must be a numbered list starting with "Step 1:".
     7.  The only allowed actions are `navigate to [URL]` and `interact with [ELEMENT DESCRIPTION] to [ACTION]`.
+    8.  If the request needs the same work done on several independent sites (e.g. "compare prices on three sites"), write one sub-task per site at the end of the plan, each starting with `navigate to [URL] (branch: [SHORT LABEL])`. Sub-tasks run in parallel, so no step may depend on another sub-task.
 
     **Suggested URLs from Analyst:**
     {{suggested_urls}}
@@ -103,6 +121,7 @@ plan_formatter_agent = LlmAgent(
 
     The raw text contains steps like "Step 1: navigate to https://..." or "Step 2: interact with...".
     You must parse each step and map it to the correct `NavigateAction` or `InteractAction` model.
+    A step like "navigate to https://... (branch: amazon)" sets `branch` to "amazon"; leave `branch` unset otherwise.
 
     **Raw Text Input:**
     {{raw_steps}}
@@ -123,4 +142,138 @@ planning_agent = SequentialAgent(
     ],
 )
 
-__all__ = ["planning_agent", "Plan"]
+
+# --- Fast planning: one structured call, with URL research only when needed ---
+
+URL_PATTERN = re.compile(r"https?://[^\s<>\"')]+", re.IGNORECASE)
+DOMAIN_PATTERN = re.compile(
+    r"\b(?:[a-z0-9-]+\.)+(?:com|org|net|edu|gov|io|co|ai|dev|app|uk|de|fr|in)\b(?:/[^\s<>\"')]*)?",
+    re.IGNORECASE,
+)
+# Sites users commonly name without a domain. Only names that are not also
+# everyday words, so "book a flight" does not count as a known site.
+KNOWN_SITES = {
+    "amazon": "https://www.amazon.com",
+    "wikipedia": "https://www.wikipedia.org",
+    "youtube": "https://www.youtube.com",
+    "github": "https://github.com",
+    "reddit": "https://www.reddit.com",
+    "ebay": "https://www.ebay.com",
+    "linkedin": "https://www.linkedin.com",
+    "imdb": "https://www.imdb.com",
+    "walmart": "https://www.walmart.com",
+    "etsy": "https://www.etsy.com",
+    "arxiv": "https://arxiv.org",
+    "stack overflow": "https://stackoverflow.com",
+    "google maps": "https://www.google.com/maps",
+    "hacker news": "https://news.ycombinator.com",
+}
+
+
+def urls_in_query(query: str) -> List[str]:
+    """
+    The starting URLs a request already names: explicit URLs, bare domains
+    and well known sites, in that order and without duplicates. Empty when
+    the planner needs to research where to go.
+    """
+    urls = [url.rstrip(".,;:!?") for url in URL_PATTERN.findall(query)]
+    rest = URL_PATTERN.sub(" ", query)
+    urls += [
+        "https://" + match.group(0).rstrip(".,;:!?")
+        for match in DOMAIN_PATTERN.finditer(rest)
+        if "@" not in rest[max(match.start() - 1, 0) : match.start()]
+    ]
+    lowered = rest.lower()
+    urls += [
+        url
+        for name, url in KNOWN_SITES.items()
+        if re.search(rf"\b{re.escape(name)}\b", lowered)
+        and not any(name.replace(" ", "") in found.lower() for found in urls)
+    ]
+    return list(dict.fromkeys(urls))
+
+
+# One call that goes straight from the request to a Plan.
+single_call_planner = LlmAgent(
+    name="FastPlanner",
+    model="gemini-2.0-flash",
+    description="Turns a user request directly into a structured plan.",
+    output_schema=Plan,
+    instruction="""
+    You are an expert web automation strategist. Turn the user's request into a step-by-step plan for a browser agent, as a JSON object that conforms to the `Plan` schema.
+
+    **Rules:**
+    1.  Start with a `navigate` step to the single best starting URL below.
+    2.  Think about every single click and keystroke. Do not combine steps. A login requires typing a username, typing a password, and clicking a button (three separate `interact` steps).
+    3.  Be extremely descriptive in `element_description`. Instead of "search bar", say "the search input field with the placeholder text 'Search Wikipedia'".
+    4.  `interaction_type` is "click", "type" or "select"; `value` holds the text to type or the option to select.
+    5.  If the request needs the same work done on several independent sites (e.g. "compare prices on three sites"), put one sub-task per site at the end of the plan. Each starts with a `navigate` step whose `branch` is a short label for the site. Sub-tasks run in parallel, so no step may depend on another sub-task. Leave `branch` unset otherwise.
+
+    **Starting URLs:**
+    {{suggested_urls}}
+
+    Your output MUST be a single, valid JSON object with the steps under the "steps" key.
+    """,
+    output_key="plan",
+)
+
+# url_suggestor already belongs to planning_agent, and an agent has one parent.
+fast_url_suggestor = url_suggestor.model_copy(
+    update={"name": "FastUrlSuggestor", "parent_agent": None}
+)
+
+
+class FastPlanningAgent(BaseAgent):
+    """
+    Plans with a single structured-output call. URL research, a search plus
+    a model call of its own, only runs when the request does not already name
+    where to start.
+    """
+
+    url_suggestor: BaseAgent
+    planner: BaseAgent
+
+    model_config = {"arbitrary_types_allowed": True}
+
+    def __init__(
+        self, name: str, url_suggestor: BaseAgent, planner: BaseAgent, **kwargs
+    ):
+        super().__init__(
+            name=name,
+            url_suggestor=url_suggestor,
+            planner=planner,
+            sub_agents=[url_suggestor, planner],
+            **kwargs,
+        )
+
+    @override
+    async def _run_async_impl(
+        self, ctx: InvocationContext
+    ) -> AsyncGenerator[Event, None]:
+        query = ""
+        if ctx.user_content and ctx.user_content.parts:
+            query = "".join(part.text or "" for part in ctx.user_content.parts)
+        urls = urls_in_query(query or ctx.session.state.get("user_query") or "")
+        if urls:
+            logger.info(
+                f"[{self.name}] Request names its starting URL ({urls[0]}); skipping URL research."
+            )
+            ctx.session.state["suggested_urls"] = "\n".join(
+                f"{i}. {url} - Named in the user's request."
+                for i, url in enumerate(urls, start=1)
+            )
+        else:
+            async for event in self.url_suggestor.run_async(ctx):
+                yield event
+        async for event in self.planner.run_async(ctx):
+            yield event
+
+
+fast_planning_agent = FastPlanningAgent(
+    name="fast_planning_agent",
+    description="Plans in a single structured call, researching URLs only when needed.",
+    url_suggestor=fast_url_suggestor,
+    planner=single_call_planner,
+)
+
+__all__ = ["planning_agent", "fast_planning_agent", "urls_in_query", "Plan"]
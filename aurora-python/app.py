@@ -3,22 +3,33 @@ from dotenv import load_dotenv
 import asyncio
 import base64
 import json
+import logging
 import os
-import uuid
-from contextlib import asynccontextmanager
+import time
+from contextlib import asynccontextmanager, suppress
 
-from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from google.adk.events import Event, EventActions
 from google.adk.runners import Runner
-from google.adk.sessions import InMemorySessionService
 from google.genai import types
 from pydantic import BaseModel
+from starlette.background import BackgroundTask
 
-from browser_manager import browser_manager
+from browser_manager import use_browser
+from browser_pool import browser_pool as local_browser_pool
+from browser_rpc import remote_browser_pool
+from frame_diff import FrameEncoder
+from scheduler import QueueFullError, RunTicket, run_scheduler
+from screencast import FrameSubscriber
+from session_store import session_service
+from progress import listen
+from telemetry import metrics, trace_run
 from agents import root_agent
 
 load_dotenv()
+logger = logging.getLogger(__name__)
 _original_default = json.JSONEncoder().default
 
 
@@ -35,9 +46,22 @@ if not os.getenv("GOOGLE_API_KEY"):
         "GOOGLE_API_KEY not found in environment variables. Please ensure your .env file is correctly configured and located in the aurora-python directory."
     )
 
-session_service = InMemorySessionService()
 APP_NAME = "aurora"
-client_sessions = {}
+# With AURORA_BROWSER_WORKERS set, browsers run in separate worker processes
+# (browser_worker.py) and this process only orchestrates.
+browser_pool = remote_browser_pool or local_browser_pool
+FRAME_STATS_INTERVAL = 2.0
+DISCONNECT_POLL_INTERVAL = 0.5
+SESSION_EVICTION_INTERVAL = 600.0
+# Accept header values that switch /api/chat to structured progress events.
+STREAM_FORMATS = {"application/x-ndjson": "ndjson", "text/event-stream": "sse"}
+MEDIA_TYPES = {
+    "text": "text/plain",
+    "ndjson": "application/x-ndjson",
+    "sse": "text/event-stream",
+}
+# Keeps proxies from buffering a structured stream.
+STREAM_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
 
 runner = Runner(
     agent=root_agent,
@@ -52,69 +76,295 @@ class ChatRequest(BaseModel):
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    browser_task = asyncio.create_task(browser_manager.start_browser())
+    browser_task = asyncio.create_task(_start_browser_pool())
+    eviction_task = asyncio.create_task(_evict_idle_sessions())
     try:
         yield
     finally:
-        await browser_manager.close_browser()
+        eviction_task.cancel()
+        await browser_pool.close()
         browser_task.cancel()
 
 
+async def _start_browser_pool():
+    await browser_pool.start()
+    # Without an explicit limit, admit as many runs as the workers have contexts.
+    if remote_browser_pool and not os.getenv("AURORA_MAX_CONCURRENT_RUNS"):
+        capacity = remote_browser_pool.capacity()
+        if capacity:
+            run_scheduler.resize(capacity)
+            logger.info(f"--- Admitting up to {capacity} concurrent runs ---")
+
+
+async def _evict_idle_sessions():
+    while True:
+        try:
+            await asyncio.to_thread(session_service.evict_idle)
+        except Exception as e:
+            logger.error(f"Session eviction failed: {e}")
+        await asyncio.sleep(SESSION_EVICTION_INTERVAL)
+
+
 app = FastAPI(lifespan=lifespan)
 
 
-async def stream_agent_response(message: str, client_host: str):
+async def stream_agent_response(
+    message: str,
+    client_host: str,
+    ticket: RunTicket,
+    req: Request,
+    stream_format: str = "text",
+):
+    """
+    Streams a run's output while watching the HTTP client. The run itself
+    executes in its own task, so a disconnect can cancel it even while it is
+    blocked on a model call or a browser action that produces no output.
+
+    In the "text" format only the agents' text is sent. The "ndjson" and
+    "sse" formats send every message of the run as a JSON event, starting
+    with an "accepted" event so the client gets its first byte at once.
+    """
     user_id = f"user_{client_host}"
-    session_id = client_sessions.get(user_id)
-    if not session_id:
-        session_id = str(uuid.uuid4())
-        client_sessions[user_id] = session_id
-        session_service.create_session(
+    chunks: asyncio.Queue = asyncio.Queue()
+    run = asyncio.create_task(_produce_chunks(chunks, message, user_id, ticket))
+    disconnected = asyncio.create_task(_wait_for_client_disconnect(req))
+    started = time.monotonic()
+    try:
+        if stream_format != "text":
+            yield _render({"type": "accepted"}, stream_format, 0.0)
+        while True:
+            next_chunk = asyncio.create_task(chunks.get())
+            done, _ = await asyncio.wait(
+                {next_chunk, disconnected}, return_when=asyncio.FIRST_COMPLETED
+            )
+            if next_chunk not in done:
+                next_chunk.cancel()
+                logger.warning(
+                    f"Client {user_id} disconnected after {time.monotonic() - started:.1f}s; cancelling its run."
+                )
+                break
+            chunk = next_chunk.result()
+            if chunk is None:
+                try:
+                    # Re-raises anything the run failed with.
+                    await run
+                except Exception:
+                    # Structured streams have already sent it as an error event.
+                    if stream_format == "text":
+                        raise
+                if stream_format != "text":
+                    yield _render(
+                        {"type": "done"}, stream_format, time.monotonic() - started
+                    )
+                break
+            rendered = _render(chunk, stream_format, time.monotonic() - started)
+            if rendered is not None:
+                yield rendered
+    finally:
+        disconnected.cancel()
+        if not run.done():
+            run.cancel()
+            with suppress(asyncio.CancelledError):
+                await run
+        run_scheduler.release(ticket)
+
+
+def _render(message: dict, stream_format: str, elapsed: float) -> str | None:
+    """One run message in the stream's format, or None if the format omits it."""
+    if stream_format == "text":
+        if message["type"] == "text":
+            return message["text"]
+        if message["type"] == "queued":
+            return f"Waiting for a free agent slot (position {message['position']} in queue)...\n"
+        return None
+    payload = json.dumps({**message, "at": round(elapsed, 3)}, default=str)
+    if stream_format == "sse":
+        return f"event: {message['type']}\ndata: {payload}\n\n"
+    return payload + "\n"
+
+
+def _stream_format(req: Request) -> str:
+    accept = req.headers.get("accept", "")
+    for media_type, stream_format in STREAM_FORMATS.items():
+        if media_type in accept:
+            return stream_format
+    return "text"
+
+
+async def _wait_for_client_disconnect(req: Request):
+    while not await req.is_disconnected():
+        await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
+
+
+async def _produce_chunks(
+    chunks: asyncio.Queue, message: str, user_id: str, ticket: RunTicket
+):
+    try:
+        async for position in run_scheduler.wait(ticket):
+            await chunks.put({"type": "queued", "position": position})
+        # Plan and step progress from the agents joins the same queue.
+        with listen(chunks.put_nowait):
+            async for item in _run_agent(message, user_id):
+                await chunks.put(item)
+    except Exception as e:
+        chunks.put_nowait({"type": "error", "message": str(e)})
+        raise
+    finally:
+        chunks.put_nowait(None)
+
+
+async def _run_agent(message: str, user_id: str):
+    # One session per client, so it can be found again after a restart.
+    session_id = f"session_{user_id}"
+    session = session_service.get_session(
+        app_name=APP_NAME, user_id=user_id, session_id=session_id
+    )
+    if not session:
+        session = session_service.create_session(
             app_name=APP_NAME,
             user_id=user_id,
             session_id=session_id,
             state={"user_query": message},
         )
     else:
-        session = session_service.get_session(
-            app_name=APP_NAME, user_id=user_id, session_id=session_id
+        # Through an event, so the query is stored and not only cached.
+        session_service.append_event(
+            session,
+            Event(
+                author="user",
+                actions=EventActions(state_delta={"user_query": message}),
+            ),
         )
-        if session:
-            session.state["user_query"] = message
-            session_service.update_session(session)
     parts = [types.Part(text=message)]
     new_message_content = types.Content(role="user", parts=parts)
 
-    async for event in runner.run_async(
-        user_id=user_id, session_id=session_id, new_message=new_message_content
-    ):
-        if event.content and event.content.parts:
-            for part in event.content.parts:
-                if hasattr(part, "text") and part.text:
-                    yield part.text
+    try:
+        async with browser_pool.lease(user_id) as browser:
+            with use_browser(browser), trace_run(user_id):
+                async for event in runner.run_async(
+                    user_id=user_id,
+                    session_id=session_id,
+                    new_message=new_message_content,
+                ):
+                    for item in _event_messages(event):
+                        yield item
+    finally:
+        session_service.trim_state(session)
+
+
+def _event_messages(event) -> list:
+    """The tool calls, tool results and text of an ADK event, as run messages."""
+    messages = []
+    for call in event.get_function_calls():
+        messages.append(
+            {
+                "type": "tool_call",
+                "agent": event.author,
+                "name": call.name,
+                "args": call.args,
+            }
+        )
+    for response in event.get_function_responses():
+        messages.append(
+            {
+                "type": "tool_result",
+                "agent": event.author,
+                "name": response.name,
+                "result": response.response,
+            }
+        )
+    if event.content and event.content.parts:
+        for part in event.content.parts:
+            if hasattr(part, "text") and part.text:
+                messages.append(
+                    {"type": "text", "agent": event.author, "text": part.text}
+                )
+    return messages
+
+
+@app.get("/metrics")
+async def metrics_handler():
+    return PlainTextResponse(
+        metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
 
 
 @app.post("/api/chat")
 async def chat_handler(request: ChatRequest, req: Request):
     client_host = req.client.host
-    generator = stream_agent_response(request.message, client_host)
-    return StreamingResponse(generator, media_type="text/plain")
+    try:
+        ticket = run_scheduler.enqueue(f"user_{client_host}")
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    stream_format = _stream_format(req)
+    generator = stream_agent_response(
+        request.message, client_host, ticket, req, stream_format
+    )
+    # The background task only matters if the stream never started; otherwise
+    # the generator has already released the ticket.
+    return StreamingResponse(
+        generator,
+        media_type=MEDIA_TYPES[stream_format],
+        headers=STREAM_HEADERS if stream_format != "text" else None,
+        background=BackgroundTask(run_scheduler.release, ticket),
+    )
+
+
+async def _send_frames(websocket: WebSocket, subscriber: FrameSubscriber):
+    last_report = time.monotonic()
+    reported_dropped = 0
+    encoder = FrameEncoder()
+    while True:
+        frame = await subscriber.get()
+        payload = await asyncio.to_thread(encoder.encode, frame)
+        if payload is None:
+            continue
+        await websocket.send_bytes(payload)
+
+        now = time.monotonic()
+        if (
+            subscriber.dropped != reported_dropped
+            and now - last_report >= FRAME_STATS_INTERVAL
+        ):
+            await websocket.send_text(
+                json.dumps({"type": "frame_stats", **subscriber.stats()})
+            )
+            reported_dropped = subscriber.dropped
+            last_report = now
+
+
+async def _wait_for_disconnect(websocket: WebSocket):
+    while True:
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            return
 
 
 @app.websocket("/ws/agent")
 async def agent_websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
+    user_id = f"user_{websocket.client.host}"
+    screencast = browser_pool.screencast_for(user_id)
+    subscriber = await screencast.subscribe()
+    sender = asyncio.create_task(_send_frames(websocket, subscriber))
+    receiver = asyncio.create_task(_wait_for_disconnect(websocket))
     try:
-        while True:
-            screenshot_data = await browser_manager.get_screenshot()
-            if screenshot_data and "screenshot" in screenshot_data:
-                await websocket.send_bytes(screenshot_data["screenshot"])
-
-            await asyncio.sleep(0.5)
-    except WebSocketDisconnect:
-        pass
-    except Exception as e:
-        print(f"WebSocket error: {e}")
+        done, _ = await asyncio.wait(
+            {sender, receiver}, return_when=asyncio.FIRST_COMPLETED
+        )
+        for task in done:
+            exc = task.exception()
+            if exc and not isinstance(exc, WebSocketDisconnect):
+                logger.error(f"WebSocket error: {exc}")
+    finally:
+        sender.cancel()
+        receiver.cancel()
+        await screencast.unsubscribe(subscriber)
+        browser_pool.discard_screencast(user_id)
+        stats = subscriber.stats()
+        logger.info(
+            f"WebSocket viewer closed: {stats['delivered']} frames sent, {stats['dropped']} dropped"
+        )
 
 
 app.add_middleware(
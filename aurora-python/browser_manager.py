@@ -1,125 +1,419 @@
+import asyncio
 import traceback
 import json
 import logging
-from playwright.async_api import async_playwright, Page, Playwright, Locator
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from playwright.async_api import Browser, BrowserContext, CDPSession, Page, Locator
 from typing import Dict, Any, List
 
+from accessibility import interactive_elements
+from page_readiness import NetworkTracker, page_readiness
+from request_policy import RequestStats, request_policy
+from telemetry import COUNT_BUCKETS, metrics, span
+from page_scripts import (
+    AX_ID_ATTRIBUTE,
+    ELEMENT_ID_ATTRIBUTE,
+    EXTRACT_ELEMENTS_SCRIPT,
+    INDEX_STATE_SCRIPT,
+    INSTALL_ACTIVITY_SCRIPT,
+    INSTALL_INDEX_SCRIPT,
+    TAG_NODE_FUNCTION,
+)
+
 logger = logging.getLogger(__name__)
 
+# Attributes worth showing the LLM in the compact format, in display order.
+# Everything else (classes, inline styles, tracking data-*) is dropped.
+LLM_ATTRIBUTES = (
+    "aria-label",
+    "placeholder",
+    "name",
+    "type",
+    "role",
+    "title",
+    "alt",
+    "value",
+    "href",
+    "id",
+    "description",
+    "checked",
+    "expanded",
+    "selected",
+    "disabled",
+    "required",
+    "context",
+)
+
 
 class BrowserManager:
-    def __init__(self, headless: bool = True):
-        self.playwright: Playwright | None = None
-        self.browser = None
+    """Drives a single page inside its own isolated browser context."""
+
+    def __init__(self):
+        self.context: BrowserContext | None = None
         self.page: Page | None = None
-        self.headless = headless
+        self.cdp: CDPSession | None = None
+        self.network: NetworkTracker | None = None
+        # False for a tab opened by new_tab, which only owns its page.
+        self.owns_context = True
+        # What the request policy blocked or served from cache for this page.
+        self.request_stats = RequestStats()
 
         self.clickable_elements: List[Dict[str, Any]] = []
         self.form_elements: List[Dict[str, Any]] = []
+        # (docId, version) of the page-side element index the caches reflect.
+        self.element_index_state: Dict[str, Any] | None = None
+        # A scan started ahead of time for the next step, see prefetch_elements.
+        self._prefetch: asyncio.Task | None = None
 
         self.CLICKABLE_SELECTOR = "a, button, [role='button'], input[type='submit'], input[type='button'], input[type='reset']"
         self.FORM_SELECTOR = 'input:not([type="submit"]):not([type="button"]):not([type="reset"]):not([type="checkbox"]):not([type="radio"]), textarea'
 
-    async def start_browser(self):
-        print("--- Starting Browser ---")
-        self.playwright = await async_playwright().start()
-        self.browser = await self.playwright.chromium.launch(headless=self.headless)
-        self.page = await self.browser.new_page()
-        await self.navigate("https://www.google.com")
-        print("--- Browser Started ---")
-
-    async def close_browser(self):
-        if self.browser:
-            await self.browser.close()
-        if self.playwright:
-            await self.playwright.stop()
-        print("--- Browser Closed ---")
+        # "dom" scans CLICKABLE_SELECTOR/FORM_SELECTOR; "accessibility" takes a
+        # CDP accessibility snapshot, which also finds custom widgets and
+        # elements inside shadow DOM.
+        self.ELEMENT_SOURCE = os.getenv("AURORA_ELEMENT_SOURCE", "dom")
+        # "compact" (one line per element) or "json" (the full attribute dump).
+        self.ELEMENT_FORMAT = os.getenv("AURORA_ELEMENT_FORMAT", "compact")
+        # Rough token allowance for one element list in a prompt; decides how
+        # many elements fit when no explicit page size is given.
+        self.ELEMENT_TOKEN_BUDGET = int(
+            os.getenv("AURORA_ELEMENT_TOKEN_BUDGET", "1500")
+        )
+        self.TEXT_BUDGET = 80
+        self.ATTRIBUTE_BUDGET = 60
+
+    async def open(self, browser: Browser, start_url: str = "https://www.google.com"):
+        self.context = await browser.new_context()
+        if request_policy.active:
+            await self.context.route(
+                "**/*", lambda route: request_policy.handle(route, self.request_stats)
+            )
+        await self._open_page()
+        await self.navigate(start_url)
+
+    async def _open_page(self):
+        self.page = await self.context.new_page()
+        await self.page.add_init_script(
+            f"({INSTALL_INDEX_SCRIPT.strip()})({json.dumps(self._element_selectors())})"
+        )
+        await self.page.add_init_script(f"({INSTALL_ACTIVITY_SCRIPT.strip()})()")
+        self.network = NetworkTracker(self.page)
+
+    async def new_tab(self) -> "BrowserManager":
+        """
+        A manager for a new blank page in this context, sharing its cookies
+        and request policy. Closing the tab leaves this context open.
+        """
+        tab = BrowserManager()
+        tab.context = self.context
+        tab.request_stats = self.request_stats
+        tab.owns_context = False
+        await tab._open_page()
+        return tab
+
+    async def close(self):
+        self._cancel_prefetch()
+        self.cdp = None
+        self.network = None
+        if self.owns_context and self.context:
+            await self.context.close()
+        elif self.page:
+            await self.page.close()
+        self.context = None
+        self.page = None
+
+    async def reset(self):
+        """Stops any in-flight load and forgets the element state of an aborted run."""
+        self._cancel_prefetch()
+        self.clickable_elements = []
+        self.form_elements = []
+        self.element_index_state = None
+        if self.page:
+            await self.page.evaluate("window.stop()")
 
     async def navigate(self, url: str):
         if self.page:
             logger.info(f"--- Navigating to {url} ---")
-            await self.page.goto(url, wait_until="domcontentloaded", timeout=60000)
+            self._cancel_prefetch()
+            with span("aurora_action_seconds", action="navigate"):
+                await self.page.goto(url, wait_until="domcontentloaded", timeout=60000)
+            readiness = await self.wait_until_ready("navigate")
             self.clickable_elements = []
             self.form_elements = []
-            return {"status": "success", "url": self.page.url}
+            self.element_index_state = None
+            return {
+                "status": "success",
+                "url": self.page.url,
+                "settled": readiness["settled"],
+                "ready_in": round(readiness["waited"], 2),
+            }
+
+    async def wait_until_ready(self, after: str) -> Dict[str, Any]:
+        """Waits for the page to settle after an action and logs how long it took."""
+        if not self.page or not self.network:
+            return {"waited": 0.0, "settled": True, "budget": 0.0}
+        with span("aurora_readiness_wait_seconds", after=after) as attrs:
+            readiness = await page_readiness.wait(self.page, self.network)
+            attrs["settled"] = readiness["settled"]
+        logger.info(
+            f"--- Page {'settled' if readiness['settled'] else 'not settled'} "
+            f"{readiness['waited']:.2f}s after {after} (budget {readiness['budget']:.1f}s) ---"
+        )
+        return readiness
+
+    @staticmethod
+    def _describe_readiness(readiness: Dict[str, Any]) -> str:
+        if readiness["settled"]:
+            return f"Page settled in {readiness['waited']:.1f}s."
+        return f"Page still loading after {readiness['waited']:.1f}s."
 
     async def get_screenshot(self, full_page: bool = False) -> dict | None:
         if not self.page:
             return None
         try:
-            screenshot = await self.page.screenshot(
-                type="jpeg", quality=80, timeout=60000, full_page=full_page
-            )
+            with span("aurora_screenshot_seconds"):
+                screenshot = await self.page.screenshot(
+                    type="jpeg", quality=80, timeout=60000, full_page=full_page
+                )
             return {"screenshot": screenshot}
         except Exception as e:
             logger.error(f"Error taking screenshot: {e}")
             return None
 
-    async def _get_elements(self, selector: str, cache_list: list):
+    def _element_selectors(self) -> Dict[str, str]:
+        return {"clickable": self.CLICKABLE_SELECTOR, "form": self.FORM_SELECTOR}
+
+    def prefetch_elements(self):
+        """
+        Starts scanning the page in the background, e.g. while a decision
+        agent is still writing up an action it has already taken. The next
+        scan_elements call picks up the result instead of starting from zero.
+
+        Only the DOM source prefetches: its index records what a later scan
+        would find, so that scan returns at once if nothing changed. An
+        accessibility snapshot has no such check (the index cannot see shadow
+        roots, custom widgets or option, tab and checkbox state), so it is
+        always retaken and prefetching it would be wasted work.
+        """
+        if self.ELEMENT_SOURCE == "accessibility":
+            return
+        if self.page and (self._prefetch is None or self._prefetch.done()):
+            self._prefetch = asyncio.create_task(self._scan())
+
+    def _cancel_prefetch(self):
+        if self._prefetch and not self._prefetch.done():
+            self._prefetch.cancel()
+        self._prefetch = None
+
+    async def scan_elements(self):
+        """
+        Refreshes both element caches. After a prefetch this scan only
+        confirms the page index; the table is sent again only if it changed.
+        """
+        with span("aurora_element_scan_seconds", source=self.ELEMENT_SOURCE) as attrs:
+            prefetch, self._prefetch = self._prefetch, None
+            attrs["prefetched"] = prefetch is not None
+            if prefetch:
+                started = time.monotonic()
+                await prefetch
+                logger.info(
+                    f"--- Waited {time.monotonic() - started:.2f}s for prefetched elements ---"
+                )
+            await self._scan()
+            attrs["clickable"] = len(self.clickable_elements)
+            attrs["form"] = len(self.form_elements)
+        for kind in ("clickable", "form"):
+            metrics.observe(
+                "aurora_elements_found", attrs[kind], buckets=COUNT_BUCKETS, kind=kind
+            )
+
+    async def _scan(self):
+        """
+        Refreshes both element caches with one in-page evaluation. The page
+        only sends the element table back if its index has changed since the
+        last scan; otherwise the cached table is reused as is.
+        """
         if not self.page:
             return
+        if self.ELEMENT_SOURCE == "accessibility":
+            await self._scan_accessibility_tree()
+            return
         try:
-            locators = await self.page.locator(selector).all()
-            cache_list.clear()
+            result = await self.page.evaluate(
+                EXTRACT_ELEMENTS_SCRIPT,
+                {
+                    "selectors": self._element_selectors(),
+                    "idAttribute": ELEMENT_ID_ATTRIBUTE,
+                    "known": self.element_index_state,
+                },
+            )
+        except Exception as e:
+            logger.error(f"Error scanning page elements: {e}")
+            return
+        if result["elements"] is None:
+            logger.info("--- Page unchanged since last scan, reusing elements ---")
+            return
+        elements = result["elements"]
+        self.clickable_elements = [el for el in elements["clickable"] if el["visible"]]
+        self.form_elements = [el for el in elements["form"] if el["visible"]]
+        self.element_index_state = result["state"]
+
+    async def _scan_accessibility_tree(self):
+        """
+        Rebuilds both caches from one accessibility snapshot. The snapshot is
+        always retaken because the DOM index cannot see changes inside shadow
+        roots; it is only used to pin the ids to the current document.
+        """
+        try:
+            state = await self.page.evaluate(
+                INDEX_STATE_SCRIPT, self._element_selectors()
+            )
+            cdp = await self._cdp_session()
+            snapshot = await cdp.send("Accessibility.getFullAXTree")
+        except Exception as e:
+            logger.error(f"Error taking accessibility snapshot: {e}")
+            return
+        self.clickable_elements, self.form_elements = interactive_elements(
+            snapshot["nodes"]
+        )
+        self.element_index_state = state
+
+    async def _cdp_session(self) -> CDPSession:
+        if self.cdp is None:
+            self.cdp = await self.context.new_cdp_session(self.page)
+        return self.cdp
 
-            for i, locator in enumerate(locators):
-                cache_list.append({"id": i, "locator": locator})
+    async def _element_ids_are_current(self) -> bool:
+        """Element ids are only meaningful within the document they were scanned from."""
+        try:
+            state = await self.page.evaluate(
+                INDEX_STATE_SCRIPT, self._element_selectors()
+            )
         except Exception as e:
-            logger.error(f"Error getting elements with selector '{selector}': {e}")
+            logger.error(f"Error reading element index state: {e}")
+            return False
+        known = self.element_index_state
+        return bool(state and known and state["docId"] == known["docId"])
 
     async def get_clickable_elements(self):
-        await self._get_elements(self.CLICKABLE_SELECTOR, self.clickable_elements)
+        await self.scan_elements()
         return f"Found {len(self.clickable_elements)} clickable elements."
 
     async def get_form_elements(self):
-        await self._get_elements(self.FORM_SELECTOR, self.form_elements)
+        await self.scan_elements()
         return f"Found {len(self.form_elements)} form elements."
 
-    async def _get_element_details_for_llm(
+    def _get_element_details_for_llm(
         self, element_info: Dict[str, Any]
     ) -> Dict[str, Any]:
-        """Helper to extract detailed information from a Playwright locator."""
-        locator = element_info["locator"]
-
-        if not await locator.is_visible():
-            return None
-
-        tag = await locator.evaluate("el => el.tagName.toLowerCase()")
-        text = (await locator.inner_text() or "").strip().replace('"', "'")
-        attributes = await locator.evaluate(
-            "el => Array.from(el.attributes).reduce((obj, attr) => { obj[attr.name] = attr.value; return obj; }, {})"
-        )
-
+        """Helper to shape a cached element record for the LLM."""
         return {
             "id": element_info["id"],
-            "tag": tag,
-            "text": text,
-            "attributes": attributes,
+            "tag": element_info["tag"],
+            "text": element_info["text"].replace('"', "'"),
+            "attributes": element_info["attributes"],
         }
 
+    def _get_element_line_for_llm(self, element_info: Dict[str, Any]) -> str:
+        """One line per element: `#id tag "text" attr="value" ...`."""
+        parts = [f"#{element_info['id']}", element_info["tag"]]
+        text = self._truncate(element_info["text"], self.TEXT_BUDGET)
+        if text:
+            parts.append(json.dumps(text, ensure_ascii=False))
+        attributes = element_info["attributes"]
+        for name in LLM_ATTRIBUTES:
+            value = self._truncate(attributes.get(name) or "", self.ATTRIBUTE_BUDGET)
+            if value:
+                parts.append(f"{name}={json.dumps(value, ensure_ascii=False)}")
+        return " ".join(parts)
+
+    @staticmethod
+    def _truncate(value: str, budget: int) -> str:
+        value = " ".join(value.split())
+        return value if len(value) <= budget else value[: budget - 1] + "…"
+
+    @staticmethod
+    def _estimate_tokens(text: str) -> int:
+        return len(text) // 4 + 1
+
+    def format_elements_for_llm(
+        self,
+        elements: List[Dict[str, Any]],
+        token_budget: int | None = None,
+        element_format: str | None = None,
+    ) -> str:
+        """
+        Serializes elements for a prompt in the selected format, stopping once
+        `token_budget` is spent and noting how many elements were left out.
+        """
+        element_format = element_format or self.ELEMENT_FORMAT
+        if element_format == "compact":
+            rendered = [self._get_element_line_for_llm(el) for el in elements]
+        else:
+            rendered = [
+                json.dumps(self._get_element_details_for_llm(el), indent=2)
+                for el in elements
+            ]
+
+        shown = []
+        spent = 0
+        for item in rendered:
+            cost = self._estimate_tokens(item)
+            if token_budget is not None and shown and spent + cost > token_budget:
+                break
+            shown.append(item)
+            spent += cost
+
+        if element_format == "compact":
+            output = "\n".join(shown)
+        else:
+            output = "[\n" + ",\n".join(shown) + "\n]"
+        if len(shown) < len(rendered):
+            output += f"\n({len(rendered) - len(shown)} more elements not shown)"
+        return output
+
     async def get_clickable_elements_for_llm(
-        self, start_index: int = 0, elements: int = 20
+        self, start_index: int = 0, elements: int | None = None
     ) -> str:
-        llm_friendly_elements = []
-        paginated_elements = self.clickable_elements[
-            start_index : start_index + elements
-        ]
-        for el_info in paginated_elements:
-            details = await self._get_element_details_for_llm(el_info)
-            if details:
-                llm_friendly_elements.append(details)
-        return json.dumps(llm_friendly_elements, indent=2)
+        return self._paginate_for_llm(self.clickable_elements, start_index, elements)
 
     async def get_form_elements_for_llm(
-        self, start_index: int = 0, elements: int = 20
+        self, start_index: int = 0, elements: int | None = None
+    ) -> str:
+        return self._paginate_for_llm(self.form_elements, start_index, elements)
+
+    def _paginate_for_llm(
+        self, cache_list: list, start_index: int, elements: int | None
     ) -> str:
-        llm_friendly_elements = []
-        paginated_elements = self.form_elements[start_index : start_index + elements]
-        for el_info in paginated_elements:
-            details = await self._get_element_details_for_llm(el_info)
-            if details:
-                llm_friendly_elements.append(details)
-        return json.dumps(llm_friendly_elements, indent=2)
+        """A fixed page of `elements` if given, otherwise as many as fit the token budget."""
+        if elements is not None:
+            return self.format_elements_for_llm(
+                cache_list[start_index : start_index + elements]
+            )
+        return self.format_elements_for_llm(
+            cache_list[start_index:], token_budget=self.ELEMENT_TOKEN_BUDGET
+        )
+
+    async def _locate(self, element_id: int) -> Locator:
+        if self.ELEMENT_SOURCE != "accessibility":
+            return self.page.locator(f'[{ELEMENT_ID_ATTRIBUTE}="{element_id}"]')
+
+        # Accessibility ids are backend DOM node ids; tag the node so a normal
+        # (shadow-piercing) attribute locator can find it.
+        cdp = await self._cdp_session()
+        node = await cdp.send("DOM.resolveNode", {"backendNodeId": element_id})
+        await cdp.send(
+            "Runtime.callFunctionOn",
+            {
+                "objectId": node["object"]["objectId"],
+                "functionDeclaration": TAG_NODE_FUNCTION,
+                "arguments": [{"value": AX_ID_ATTRIBUTE}, {"value": str(element_id)}],
+            },
+        )
+        return self.page.locator(f'[{AX_ID_ATTRIBUTE}="{element_id}"]')
 
     async def click_element(self, element_id: int):
         if not self.page:
@@ -130,13 +424,16 @@ class BrowserManager:
         )
         if not target_element_info:
             return f"Error: Element with ID '{element_id}' not found in the clickable elements cache."
-
-        locator = target_element_info["locator"]
+        if not await self._element_ids_are_current():
+            return f"Error: The page has changed since element {element_id} was scanned. Fetch the elements again."
 
         logger.info(f"--- Clicking Element ID {element_id} ---")
         try:
-            await locator.click(timeout=10000)
-            return f"Successfully clicked element {element_id}."
+            locator = await self._locate(element_id)
+            with span("aurora_action_seconds", action="click"):
+                await locator.click(timeout=10000)
+            readiness = await self.wait_until_ready("click")
+            return f"Successfully clicked element {element_id}. {self._describe_readiness(readiness)}"
         except Exception as e:
             return f"Error clicking element {element_id}: {traceback.format_exc()}"
 
@@ -151,17 +448,46 @@ class BrowserManager:
         )
         if not target_element_info:
             return f"Error: Element with ID '{element_id}' not found in the form elements cache."
-
-        locator = target_element_info["locator"]
+        if not await self._element_ids_are_current():
+            return f"Error: The page has changed since element {element_id} was scanned. Fetch the elements again."
 
         logger.info(f"--- Typing '{text_to_type}' into Element ID {element_id} ---")
         try:
-            await locator.fill(text_to_type, timeout=10000)
-            if submit:
-                await locator.press("Enter")
-            return f"Successfully typed into element {element_id}."
+            locator = await self._locate(element_id)
+            # The accessibility source reports native <select>s as comboboxes,
+            # which take an option rather than typed text.
+            if target_element_info["tag"] == "combobox" and (
+                await locator.evaluate("el => el.tagName.toLowerCase()") == "select"
+            ):
+                with span("aurora_action_seconds", action="select"):
+                    await locator.select_option(label=text_to_type, timeout=10000)
+                readiness = await self.wait_until_ready("select")
+                return f"Successfully selected '{text_to_type}' in element {element_id}. {self._describe_readiness(readiness)}"
+            with span("aurora_action_seconds", action="type"):
+                await locator.fill(text_to_type, timeout=10000)
+                if submit:
+                    await locator.press("Enter")
+            readiness = await self.wait_until_ready("type")
+            return f"Successfully typed into element {element_id}. {self._describe_readiness(readiness)}"
         except Exception as e:
             return f"Error typing into element {element_id}: {traceback.format_exc()}"
 
 
-browser_manager = BrowserManager()
+_current_browser: ContextVar[BrowserManager] = ContextVar("current_browser")
+
+
+def current_browser() -> BrowserManager:
+    """Returns the BrowserManager leased to the agent run in progress."""
+    try:
+        return _current_browser.get()
+    except LookupError:
+        raise RuntimeError("No browser is leased to the current agent run.")
+
+
+@contextmanager
+def use_browser(manager: BrowserManager):
+    token = _current_browser.set(manager)
+    try:
+        yield manager
+    finally:
+        _current_browser.reset(token)
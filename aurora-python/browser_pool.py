@@ -0,0 +1,305 @@
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Set, Tuple
+
+from playwright.async_api import Browser, Playwright, async_playwright
+
+from browser_manager import BrowserManager
+from screencast import ScreencastBroadcaster
+
+logger = logging.getLogger(__name__)
+
+
+class PooledBrowser:
+    """Bookkeeping for one isolated context held by the pool."""
+
+    def __init__(self, manager: BrowserManager):
+        self.manager = manager
+        self.session_key: str | None = None
+        self.leased = False
+        self.tasks_completed = 0
+        self.last_used = time.monotonic()
+
+
+class BrowserPool:
+    """
+    Hands out isolated browser contexts, one per session, from a single
+    Chromium process.
+
+    A session keeps the same context (and so its cookies and current page)
+    across requests until it is evicted for being idle or recycled after
+    `max_tasks_per_context` leases. `min_idle` unassigned contexts are kept
+    warm so a new session does not pay for context creation.
+    """
+
+    def __init__(
+        self,
+        size: int = 4,
+        min_idle: int = 1,
+        idle_timeout: float = 600.0,
+        max_tasks_per_context: int = 25,
+        headless: bool = True,
+        start_url: str = "https://www.google.com",
+    ):
+        self.size = size
+        self.min_idle = min_idle
+        self.idle_timeout = idle_timeout
+        self.max_tasks_per_context = max_tasks_per_context
+        self.headless = headless
+        self.start_url = start_url
+
+        self.playwright: Playwright | None = None
+        self.browser: Browser | None = None
+        self.entries: List[PooledBrowser] = []
+        self.screencasts: Dict[str, ScreencastBroadcaster] = {}
+
+        # Contexts being opened outside the condition, and the sessions
+        # waiting on one of them.
+        self._pending = 0
+        self._opening: Set[str] = set()
+        self._condition = asyncio.Condition()
+        self._reaper_task: asyncio.Task | None = None
+        self._top_up_task: asyncio.Task | None = None
+
+    async def start(self):
+        print("--- Starting Browser Pool ---")
+        self.playwright = await async_playwright().start()
+        self.browser = await self.playwright.chromium.launch(headless=self.headless)
+        await self._top_up()
+        self._reaper_task = asyncio.create_task(self._reap_loop())
+        print(f"--- Browser Pool Started ({len(self.entries)} warm contexts) ---")
+
+    async def close(self):
+        if self._reaper_task:
+            self._reaper_task.cancel()
+        if self._top_up_task:
+            self._top_up_task.cancel()
+        for screencast in self.screencasts.values():
+            await screencast.detach()
+        for entry in self.entries:
+            await entry.manager.close()
+        self.entries.clear()
+        if self.browser:
+            await self.browser.close()
+        if self.playwright:
+            await self.playwright.stop()
+        print("--- Browser Pool Closed ---")
+
+    def screencast_for(self, session_key: str) -> ScreencastBroadcaster:
+        """The broadcaster that follows whichever page the session is using."""
+        if session_key not in self.screencasts:
+            self.screencasts[session_key] = ScreencastBroadcaster()
+        return self.screencasts[session_key]
+
+    def discard_screencast(self, session_key: str):
+        """Forgets a session's broadcaster once nothing is watching or attached."""
+        screencast = self.screencasts.get(session_key)
+        if screencast and not screencast.subscribers and screencast.page is None:
+            del self.screencasts[session_key]
+
+    @asynccontextmanager
+    async def lease(self, session_key: str) -> AsyncIterator[BrowserManager]:
+        entry = await self._acquire(session_key)
+        try:
+            yield entry.manager
+        except BaseException:
+            # The run was cancelled or crashed part way through an action, so
+            # the page may still be loading or mid-interaction.
+            await self._reset(entry)
+            raise
+        finally:
+            stats = entry.manager.request_stats
+            if stats.blocked_requests or stats.cache_hits:
+                logger.info(f"Request policy for {session_key}: {stats.snapshot()}")
+            stats.reset()
+            await self._release(entry)
+
+    async def _reset(self, entry: PooledBrowser):
+        try:
+            await asyncio.wait_for(entry.manager.reset(), timeout=5.0)
+        except Exception as e:
+            logger.warning(f"Could not reset browser context ({e}), retiring it.")
+            await self._retire(entry)
+
+    async def _acquire(self, session_key: str) -> PooledBrowser:
+        if not self.browser:
+            raise RuntimeError("The browser pool has not been started.")
+        async with self._condition:
+            while True:
+                owned = self._find(session_key)
+                if owned:
+                    if not owned.leased:
+                        entry = owned
+                        break
+                elif session_key not in self._opening:
+                    entry = self._find(None)
+                    if entry:
+                        break
+                    reserved, victim = self._make_room()
+                    if reserved:
+                        self._opening.add(session_key)
+                        break
+                await self._condition.wait()
+
+            if entry:
+                self._lease_entry(entry, session_key)
+
+        if entry is None:
+            entry = await self._open_for(session_key, victim)
+        screencast = self.screencast_for(session_key)
+        if screencast.page is not entry.manager.page:
+            await screencast.attach(entry.manager.page, entry.manager.get_screenshot)
+        logger.info(f"--- Leased browser context to {session_key} ---")
+        return entry
+
+    @staticmethod
+    def _lease_entry(entry: PooledBrowser, session_key: str):
+        entry.leased = True
+        entry.session_key = session_key
+        entry.last_used = time.monotonic()
+
+    async def _release(self, entry: PooledBrowser):
+        entry.tasks_completed += 1
+        entry.last_used = time.monotonic()
+        if entry.tasks_completed >= self.max_tasks_per_context:
+            logger.info(
+                f"--- Recycling browser context after {entry.tasks_completed} tasks ---"
+            )
+            await self._retire(entry)
+            if self._top_up_task is None or self._top_up_task.done():
+                self._top_up_task = asyncio.create_task(self._top_up())
+                self._top_up_task.add_done_callback(self._log_top_up_failure)
+        async with self._condition:
+            entry.leased = False
+            self._condition.notify_all()
+
+    @staticmethod
+    def _log_top_up_failure(task: asyncio.Task):
+        if not task.cancelled() and task.exception():
+            logger.error(f"Error topping up browser pool: {task.exception()}")
+
+    def _find(self, session_key: str | None) -> PooledBrowser | None:
+        return next(
+            (entry for entry in self.entries if entry.session_key == session_key),
+            None,
+        )
+
+    def _make_room(self) -> Tuple[bool, PooledBrowser | None]:
+        """
+        Called with the condition held when no warm context is free. Reserves
+        a slot for a new context if the pool has space, otherwise frees one by
+        taking the least recently used idle session out of the pool. Returns
+        whether a slot was reserved, and the evicted entry still to be closed.
+        """
+        if len(self.entries) + self._pending < self.size:
+            self._pending += 1
+            return True, None
+
+        idle = [entry for entry in self.entries if not entry.leased]
+        if not idle:
+            return False, None
+        victim = min(idle, key=lambda entry: entry.last_used)
+        self.entries.remove(victim)
+        self._pending += 1
+        return True, victim
+
+    async def _open_for(
+        self, session_key: str, victim: PooledBrowser | None
+    ) -> PooledBrowser:
+        """Fills a slot reserved by _make_room, without holding the condition."""
+        entry = None
+        try:
+            if victim:
+                await self._close(victim)
+            entry = PooledBrowser(await self._open())
+            self._lease_entry(entry, session_key)
+        finally:
+            async with self._condition:
+                self._pending -= 1
+                self._opening.discard(session_key)
+                if entry:
+                    self.entries.append(entry)
+                self._condition.notify_all()
+        return entry
+
+    async def _open(self) -> BrowserManager:
+        manager = BrowserManager()
+        await manager.open(self.browser, self.start_url)
+        return manager
+
+    async def _retire(self, entry: PooledBrowser):
+        if entry not in self.entries:
+            return
+        self.entries.remove(entry)
+        await self._close(entry)
+
+    async def _close(self, entry: PooledBrowser):
+        screencast = self.screencasts.get(entry.session_key)
+        if screencast and screencast.page is entry.manager.page:
+            await screencast.detach()
+            if not screencast.subscribers:
+                del self.screencasts[entry.session_key]
+        await entry.manager.close()
+
+    async def _top_up(self):
+        async with self._condition:
+            warm = sum(1 for entry in self.entries if entry.session_key is None)
+            count = max(
+                0,
+                min(
+                    self.min_idle - warm,
+                    self.size - len(self.entries) - self._pending,
+                ),
+            )
+            self._pending += count
+        # Opened outside the condition so leases are not held up meanwhile.
+        results = []
+        try:
+            results = await asyncio.gather(
+                *(self._open() for _ in range(count)), return_exceptions=True
+            )
+        finally:
+            async with self._condition:
+                self._pending -= count
+                for result in results:
+                    if isinstance(result, BaseException):
+                        logger.error(f"Could not open a warm browser context: {result}")
+                    else:
+                        self.entries.append(PooledBrowser(result))
+                self._condition.notify_all()
+
+    async def _reap_loop(self):
+        while True:
+            await asyncio.sleep(max(self.idle_timeout / 4, 1.0))
+            try:
+                await self._evict_idle()
+                await self._top_up()
+            except Exception as e:
+                logger.error(f"Error maintaining browser pool: {e}")
+
+    async def _evict_idle(self):
+        now = time.monotonic()
+        async with self._condition:
+            expired = [
+                entry
+                for entry in self.entries
+                if not entry.leased
+                and entry.session_key is not None
+                and now - entry.last_used > self.idle_timeout
+            ]
+            for entry in expired:
+                self.entries.remove(entry)
+        for entry in expired:
+            logger.info(f"--- Evicting idle browser context of {entry.session_key} ---")
+            await self._close(entry)
+
+
+browser_pool = BrowserPool(
+    size=int(os.getenv("AURORA_BROWSER_POOL_SIZE", "4")),
+    min_idle=int(os.getenv("AURORA_BROWSER_POOL_MIN_IDLE", "1")),
+    idle_timeout=float(os.getenv("AURORA_BROWSER_IDLE_TIMEOUT", "600")),
+    max_tasks_per_context=int(os.getenv("AURORA_BROWSER_MAX_TASKS", "25")),
+)
@@ -0,0 +1,408 @@
+import asyncio
+import itertools
+import json
+import logging
+import os
+import struct
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Callable, Dict, List, Tuple
+
+from browser_manager import BrowserManager
+from frame_diff import Frame
+from screencast import FrameSubscriber
+from telemetry import span
+
+logger = logging.getLogger(__name__)
+
+# Every message on a worker connection is a 5 byte header, the message kind
+# and the payload length, followed by the payload. Requests, responses and
+# notifications are JSON; screencast frames travel as raw JPEG bytes so they
+# are never base64 encoded on the way to the API process.
+HEADER = struct.Struct(">BI")
+KIND_JSON = 1
+KIND_FRAME = 2
+MAX_PAYLOAD = 64 * 1024 * 1024
+
+# Shared secret the API process presents, in an "auth" request, before a
+# worker serves anything on the connection. Set the same value on both sides.
+WORKER_TOKEN = os.getenv("AURORA_WORKER_TOKEN", "")
+# How long a worker waits for that request before dropping the connection.
+AUTH_TIMEOUT = 10
+
+# BrowserManager methods a worker will run on behalf of the API process.
+REMOTE_METHODS = {
+    "navigate",
+    "click_element",
+    "type_into_element",
+    "scan_elements",
+    "get_clickable_elements",
+    "get_form_elements",
+    "prefetch_elements",
+    "reset",
+}
+
+
+async def read_message(reader: asyncio.StreamReader) -> Tuple[int, Any]:
+    """Reads one message. JSON payloads are decoded, frames come back as (key, bytes)."""
+    kind, length = HEADER.unpack(await reader.readexactly(HEADER.size))
+    if length > MAX_PAYLOAD:
+        raise ConnectionError(f"Message of {length} bytes exceeds the RPC limit.")
+    payload = await reader.readexactly(length)
+    if kind == KIND_FRAME:
+        key_length = payload[0]
+        return kind, (payload[1 : 1 + key_length].decode(), payload[1 + key_length :])
+    return kind, json.loads(payload)
+
+
+def write_json(writer: asyncio.StreamWriter, message: Dict[str, Any]):
+    payload = json.dumps(message).encode()
+    writer.write(HEADER.pack(KIND_JSON, len(payload)) + payload)
+
+
+def write_frame(writer: asyncio.StreamWriter, key: str, data: bytes):
+    encoded_key = key.encode()[:255]
+    writer.write(
+        HEADER.pack(KIND_FRAME, 1 + len(encoded_key) + len(data))
+        + bytes([len(encoded_key)])
+        + encoded_key
+        + data
+    )
+
+
+def browser_state(manager: BrowserManager, sent: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    What the API process mirrors of a worker's BrowserManager after a call.
+    Element lists are replaced rather than mutated whenever they change, so
+    they are only sent when they are not the lists `sent` last time.
+    """
+    state: Dict[str, Any] = {"url": manager.page.url if manager.page else None}
+    for name in ("clickable_elements", "form_elements"):
+        elements = getattr(manager, name)
+        if sent.get(name) is not elements:
+            state[name] = elements
+            sent[name] = elements
+    return state
+
+
+class WorkerConnection:
+    """The API side of one connection to a browser worker process."""
+
+    def __init__(self, address: str):
+        self.address = address
+        self.reader: asyncio.StreamReader | None = None
+        self.writer: asyncio.StreamWriter | None = None
+        # Worker capacity as last reported; see refresh_load.
+        self.load: Dict[str, Any] = {"leased": 0, "size": 1}
+        # Leases handed out through this connection and not yet released.
+        self.active = 0
+        self.on_frame: Callable[[str, bytes], None] | None = None
+
+        self._ids = itertools.count(1)
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._read_task: asyncio.Task | None = None
+
+    @property
+    def connected(self) -> bool:
+        return self._read_task is not None and not self._read_task.done()
+
+    async def connect(self):
+        host, port = self.address.rsplit(":", 1)
+        self.reader, self.writer = await asyncio.open_connection(host, int(port))
+        self._read_task = asyncio.create_task(self._read_loop())
+        await self.call("auth", token=WORKER_TOKEN)
+        await self.refresh_load()
+        logger.info(f"--- Connected to browser worker {self.address} ---")
+
+    async def close(self):
+        if self._read_task:
+            self._read_task.cancel()
+        if self.writer:
+            self.writer.close()
+
+    async def call(self, method: str, **params: Any) -> Any:
+        if not self.connected:
+            raise RuntimeError(f"Browser worker {self.address} is not connected.")
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        write_json(self.writer, {"id": request_id, "method": method, "params": params})
+        try:
+            with span("aurora_rpc_seconds", method=params.get("name", method)):
+                return await future
+        finally:
+            self._pending.pop(request_id, None)
+
+    def notify(self, method: str, **params: Any):
+        """Sends a request that gets no response. Sent before any later call."""
+        if self.connected:
+            write_json(self.writer, {"id": None, "method": method, "params": params})
+
+    async def refresh_load(self):
+        self.load = await self.call("load")
+
+    def score(self) -> float:
+        """Share of the worker's contexts in use, counting leases not yet reported."""
+        return max(self.load["leased"], self.active) / max(self.load["size"], 1)
+
+    async def _read_loop(self):
+        try:
+            while True:
+                kind, message = await read_message(self.reader)
+                if kind == KIND_FRAME:
+                    if self.on_frame:
+                        self.on_frame(*message)
+                    continue
+                future = self._pending.get(message["id"])
+                if future is None or future.done():
+                    continue
+                if "error" in message:
+                    future.set_exception(RuntimeError(message["error"]))
+                else:
+                    future.set_result(message.get("result"))
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            logger.error(f"Lost connection to browser worker {self.address}: {e}")
+        finally:
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(
+                        RuntimeError(f"Browser worker {self.address} disconnected.")
+                    )
+
+
+class _RemotePage:
+    """Stands in for the worker's Page; only its URL is mirrored."""
+
+    def __init__(self, url: str | None):
+        self.url = url
+
+
+class RemoteBrowserManager(BrowserManager):
+    """
+    A BrowserManager whose page lives in a worker process. Actions are
+    forwarded over RPC; the URL and element caches are mirrored locally, so
+    element formatting and everything the agents read stay unchanged.
+    """
+
+    def __init__(self, connection: WorkerConnection, lease_id: str, state: dict):
+        super().__init__()
+        self.connection = connection
+        self.lease_id = lease_id
+        self.page = _RemotePage(None)
+        self._apply(state)
+
+    def _apply(self, state: Dict[str, Any]):
+        self.page.url = state["url"]
+        if "clickable_elements" in state:
+            self.clickable_elements = state["clickable_elements"]
+        if "form_elements" in state:
+            self.form_elements = state["form_elements"]
+
+    async def _call(self, name: str, *args: Any) -> Any:
+        response = await self.connection.call(
+            "call", lease_id=self.lease_id, name=name, args=list(args)
+        )
+        self._apply(response["state"])
+        return response["result"]
+
+    async def open(self, *args, **kwargs):
+        raise RuntimeError("Remote browsers are opened by their worker.")
+
+    async def close(self):
+        # The lease itself is released by RemoteBrowserPool.
+        if not self.owns_context:
+            self.connection.notify("release", lease_id=self.lease_id, failed=False)
+
+    async def new_tab(self) -> "RemoteBrowserManager":
+        opened = await self.connection.call("new_tab", lease_id=self.lease_id)
+        tab = RemoteBrowserManager(self.connection, opened["lease_id"], opened["state"])
+        tab.owns_context = False
+        return tab
+
+    async def reset(self):
+        await self._call("reset")
+
+    async def navigate(self, url: str):
+        return await self._call("navigate", url)
+
+    async def get_screenshot(self, full_page: bool = False) -> dict | None:
+        return None
+
+    def prefetch_elements(self):
+        self.connection.notify(
+            "call", lease_id=self.lease_id, name="prefetch_elements", args=[]
+        )
+
+    async def scan_elements(self):
+        await self._call("scan_elements")
+
+    async def get_clickable_elements(self):
+        return await self._call("get_clickable_elements")
+
+    async def get_form_elements(self):
+        return await self._call("get_form_elements")
+
+    async def click_element(self, element_id: int):
+        return await self._call("click_element", element_id)
+
+    async def type_into_element(
+        self, element_id: int, text_to_type: str, submit: bool = False
+    ):
+        return await self._call("type_into_element", element_id, text_to_type, submit)
+
+
+class RemoteScreencast:
+    """
+    The API side of a session's screencast. The worker currently holding the
+    session pushes frames while anyone here is subscribed.
+    """
+
+    def __init__(self, session_key: str, quality: int = 80):
+        self.session_key = session_key
+        self.quality = quality
+        self.worker: WorkerConnection | None = None
+        self.latest_frame: Frame | None = None
+        self.subscribers: set[FrameSubscriber] = set()
+
+    async def move_to(self, worker: WorkerConnection):
+        """Follows the session to the worker it was just leased on."""
+        if worker is self.worker:
+            return
+        if self.worker and self.subscribers:
+            self.worker.notify("unwatch", session_key=self.session_key)
+        self.worker = worker
+        self.latest_frame = None
+        if self.subscribers:
+            worker.notify("watch", session_key=self.session_key)
+
+    async def subscribe(self) -> FrameSubscriber:
+        subscriber = FrameSubscriber()
+        self.subscribers.add(subscriber)
+        if len(self.subscribers) == 1 and self.worker:
+            # The worker seeds a new watch with its last frame.
+            self.worker.notify("watch", session_key=self.session_key)
+        elif self.latest_frame is not None:
+            subscriber.offer(self.latest_frame)
+        return subscriber
+
+    async def unsubscribe(self, subscriber: FrameSubscriber):
+        self.subscribers.discard(subscriber)
+        if not self.subscribers and self.worker:
+            self.worker.notify("unwatch", session_key=self.session_key)
+
+    def publish(self, data: bytes):
+        frame = Frame(data, quality=self.quality)
+        if self.latest_frame and self.latest_frame.digest == frame.digest:
+            return
+        self.latest_frame = frame
+        for subscriber in self.subscribers:
+            subscriber.offer(frame)
+
+
+class RemoteBrowserPool:
+    """
+    Same interface as BrowserPool, but the browsers run in worker processes
+    (see browser_worker.py), locally or on other machines. A session stays on
+    the worker that holds its context; new sessions go to the least loaded
+    worker. The API process then holds no browser state of its own.
+    """
+
+    def __init__(self, addresses: List[str]):
+        self.workers = [WorkerConnection(address) for address in addresses]
+        self.assignments: Dict[str, WorkerConnection] = {}
+        self.screencasts: Dict[str, RemoteScreencast] = {}
+        for worker in self.workers:
+            worker.on_frame = self._on_frame
+
+    async def start(self):
+        print(f"--- Connecting to {len(self.workers)} browser workers ---")
+        await asyncio.gather(*(self._connect(worker) for worker in self.workers))
+
+    async def close(self):
+        for worker in self.workers:
+            await worker.close()
+        print("--- Browser Workers Disconnected ---")
+
+    def capacity(self) -> int:
+        """Browser contexts across the connected workers, as last reported."""
+        return sum(worker.load["size"] for worker in self.workers if worker.connected)
+
+    def screencast_for(self, session_key: str) -> RemoteScreencast:
+        if session_key not in self.screencasts:
+            self.screencasts[session_key] = RemoteScreencast(session_key)
+        return self.screencasts[session_key]
+
+    def discard_screencast(self, session_key: str):
+        screencast = self.screencasts.get(session_key)
+        if screencast and not screencast.subscribers:
+            del self.screencasts[session_key]
+
+    @asynccontextmanager
+    async def lease(self, session_key: str) -> AsyncIterator[BrowserManager]:
+        worker = await self._schedule(session_key)
+        worker.active += 1
+        try:
+            leased = await worker.call("lease", session_key=session_key)
+            self.assignments[session_key] = worker
+            await self.screencast_for(session_key).move_to(worker)
+            manager = RemoteBrowserManager(worker, leased["lease_id"], leased["state"])
+            logger.info(f"--- Leased {session_key} a browser on {worker.address} ---")
+            failed = False
+            try:
+                yield manager
+            except BaseException:
+                failed = True
+                raise
+            finally:
+                # The worker resets the page of a failed run before reuse.
+                if worker.connected:
+                    worker.notify("release", lease_id=leased["lease_id"], failed=failed)
+        finally:
+            worker.active -= 1
+
+    async def _schedule(self, session_key: str) -> WorkerConnection:
+        for worker in self.workers:
+            if not worker.connected:
+                await self._connect(worker)
+        live = [worker for worker in self.workers if worker.connected]
+        if not live:
+            raise RuntimeError("No browser worker is reachable.")
+
+        # The session's cookies and current page live on its worker.
+        assigned = self.assignments.get(session_key)
+        if assigned in live:
+            return assigned
+        await asyncio.gather(
+            *(worker.refresh_load() for worker in live), return_exceptions=True
+        )
+        return min(live, key=WorkerConnection.score)
+
+    async def _connect(self, worker: WorkerConnection):
+        try:
+            await worker.connect()
+        except (OSError, RuntimeError) as e:
+            logger.error(f"Could not connect to browser worker {worker.address}: {e}")
+            return
+        # Anything the worker held for us before a reconnect is gone.
+        for session_key, assigned in list(self.assignments.items()):
+            if assigned is worker:
+                del self.assignments[session_key]
+        for screencast in self.screencasts.values():
+            if screencast.worker is worker:
+                screencast.worker = None
+
+    def _on_frame(self, session_key: str, data: bytes):
+        screencast = self.screencasts.get(session_key)
+        if screencast:
+            screencast.publish(data)
+
+
+def _worker_addresses() -> List[str]:
+    value = os.getenv("AURORA_BROWSER_WORKERS", "")
+    return [address.strip() for address in value.split(",") if address.strip()]
+
+
+# Set AURORA_BROWSER_WORKERS to "host:port,host:port" to use worker processes
+# instead of an in-process browser pool.
+remote_browser_pool = (
+    RemoteBrowserPool(_worker_addresses()) if _worker_addresses() else None
+)
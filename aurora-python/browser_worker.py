@@ -0,0 +1,253 @@
+import asyncio
+import hmac
+import inspect
+import logging
+import os
+import uuid
+from contextlib import suppress
+from typing import Any, Dict, Tuple
+
+from browser_manager import BrowserManager
+from browser_pool import BrowserPool, browser_pool
+from browser_rpc import (
+    AUTH_TIMEOUT,
+    KIND_FRAME,
+    REMOTE_METHODS,
+    WORKER_TOKEN,
+    browser_state,
+    read_message,
+    write_frame,
+    write_json,
+)
+from screencast import FrameSubscriber
+
+logger = logging.getLogger(__name__)
+
+
+class _Lease:
+    def __init__(self, context, manager: BrowserManager):
+        self.context = context
+        self.manager = manager
+        # The element lists the API process already has, see browser_state.
+        self.sent: Dict[str, Any] = {}
+
+
+class BrowserWorker:
+    """
+    Serves a BrowserPool to API processes over the browser_rpc protocol.
+    Run one per core, or per machine, and list them in AURORA_BROWSER_WORKERS.
+    A connection is only served once it has presented `token`.
+    """
+
+    def __init__(self, pool: BrowserPool, token: str = WORKER_TOKEN):
+        self.pool = pool
+        self.token = token
+
+    async def serve(self, host: str, port: int):
+        if not self.token and host not in ("127.0.0.1", "localhost", "::1"):
+            raise RuntimeError(
+                f"Set AURORA_WORKER_TOKEN before listening on {host}; "
+                "anyone who can connect could otherwise drive the browsers."
+            )
+        await self.pool.start()
+        server = await asyncio.start_server(self._handle_connection, host, port)
+        print(f"--- Browser worker listening on {host}:{port} ---")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.pool.close()
+
+    async def _handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        peer = writer.get_extra_info("peername")
+        if not await self._authenticate(reader, writer):
+            logger.warning(
+                f"--- Rejected connection from {peer}: bad or missing token ---"
+            )
+            writer.close()
+            return
+        logger.info(f"--- API process connected from {peer} ---")
+        leases: Dict[str, _Lease] = {}
+        watchers: Dict[str, Tuple[FrameSubscriber, asyncio.Task]] = {}
+        tasks = set()
+        try:
+            while True:
+                kind, message = await read_message(reader)
+                if kind == KIND_FRAME:
+                    continue
+                # Requests run concurrently, but each starts in arrival order.
+                task = asyncio.create_task(
+                    self._dispatch(writer, message, leases, watchers)
+                )
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            logger.info(f"--- API process {peer} disconnected ---")
+        finally:
+            for task in tasks:
+                task.cancel()
+            for session_key in list(watchers):
+                await self._unwatch(session_key, watchers)
+            # Whatever those runs were doing was cut off part way.
+            for lease_id in sorted(
+                leases, key=lambda key: leases[key].context is not None
+            ):
+                await self._release(lease_id, True, leases)
+            writer.close()
+
+    async def _authenticate(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> bool:
+        """Checks that the first message on the connection is an "auth" with our token."""
+        try:
+            kind, message = await asyncio.wait_for(read_message(reader), AUTH_TIMEOUT)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            return False
+        if kind == KIND_FRAME or message.get("method") != "auth":
+            return False
+        token = str(message.get("params", {}).get("token", ""))
+        if not hmac.compare_digest(token.encode(), self.token.encode()):
+            write_json(writer, {"id": message.get("id"), "error": "Invalid token."})
+            return False
+        write_json(writer, {"id": message.get("id"), "result": None})
+        return True
+
+    async def _dispatch(
+        self,
+        writer: asyncio.StreamWriter,
+        message: Dict[str, Any],
+        leases: Dict[str, _Lease],
+        watchers: Dict[str, Tuple[FrameSubscriber, asyncio.Task]],
+    ):
+        request_id = message.get("id")
+        params = message.get("params", {})
+        try:
+            method = message["method"]
+            if method == "lease":
+                result = await self._lease(params["session_key"], leases)
+            elif method == "release":
+                result = await self._release(
+                    params["lease_id"], params["failed"], leases
+                )
+            elif method == "new_tab":
+                result = await self._new_tab(leases[params["lease_id"]], leases)
+            elif method == "call":
+                result = await self._call(leases[params["lease_id"]], params)
+            elif method == "watch":
+                result = await self._watch(writer, params["session_key"], watchers)
+            elif method == "unwatch":
+                result = await self._unwatch(params["session_key"], watchers)
+            elif method == "load":
+                result = self.load()
+            else:
+                raise ValueError(f"Unknown method '{method}'.")
+        except Exception as e:
+            logger.error(f"Browser worker request {message.get('method')} failed: {e}")
+            if request_id is not None:
+                write_json(writer, {"id": request_id, "error": str(e)})
+            return
+        if request_id is not None:
+            write_json(writer, {"id": request_id, "result": result})
+
+    async def _lease(self, session_key: str, leases: Dict[str, _Lease]):
+        context = self.pool.lease(session_key)
+        lease = _Lease(context, await context.__aenter__())
+        lease_id = uuid.uuid4().hex
+        leases[lease_id] = lease
+        return {"lease_id": lease_id, "state": browser_state(lease.manager, lease.sent)}
+
+    async def _new_tab(self, lease: _Lease, leases: Dict[str, _Lease]):
+        # Tabs are tracked like leases but have no pool entry of their own.
+        tab = _Lease(None, await lease.manager.new_tab())
+        tab_id = uuid.uuid4().hex
+        leases[tab_id] = tab
+        return {"lease_id": tab_id, "state": browser_state(tab.manager, tab.sent)}
+
+    async def _release(self, lease_id: str, failed: bool, leases: Dict[str, _Lease]):
+        lease = leases.pop(lease_id, None)
+        if lease is None:
+            return None
+        if lease.context is None:
+            try:
+                await lease.manager.close()
+            except Exception as e:
+                logger.debug(f"Error closing tab: {e}")
+        elif failed:
+            # Lets the pool reset the page, as it does for a local run that fails.
+            error = RuntimeError("The remote run failed or was cancelled.")
+            await lease.context.__aexit__(RuntimeError, error, None)
+        else:
+            await lease.context.__aexit__(None, None, None)
+        return None
+
+    async def _call(self, lease: _Lease, params: Dict[str, Any]):
+        name = params["name"]
+        if name not in REMOTE_METHODS:
+            raise ValueError(f"'{name}' cannot be called remotely.")
+        result = getattr(lease.manager, name)(*params.get("args", []))
+        if inspect.isawaitable(result):
+            result = await result
+        return {"result": result, "state": browser_state(lease.manager, lease.sent)}
+
+    async def _watch(
+        self,
+        writer: asyncio.StreamWriter,
+        session_key: str,
+        watchers: Dict[str, Tuple[FrameSubscriber, asyncio.Task]],
+    ):
+        if session_key in watchers:
+            return None
+        screencast = self.pool.screencast_for(session_key)
+        subscriber = await screencast.subscribe()
+        task = asyncio.create_task(
+            self._forward_frames(writer, session_key, subscriber)
+        )
+        watchers[session_key] = (subscriber, task)
+        return None
+
+    async def _unwatch(
+        self,
+        session_key: str,
+        watchers: Dict[str, Tuple[FrameSubscriber, asyncio.Task]],
+    ):
+        watcher = watchers.pop(session_key, None)
+        if watcher is None:
+            return None
+        subscriber, task = watcher
+        task.cancel()
+        await self.pool.screencast_for(session_key).unsubscribe(subscriber)
+        self.pool.discard_screencast(session_key)
+        return None
+
+    @staticmethod
+    async def _forward_frames(
+        writer: asyncio.StreamWriter, session_key: str, subscriber: FrameSubscriber
+    ):
+        with suppress(ConnectionError):
+            while True:
+                frame = await subscriber.get()
+                write_frame(writer, session_key, frame.data)
+                # While the socket is backed up, newer frames replace older
+                # ones in the subscriber instead of queueing here.
+                await writer.drain()
+
+    def load(self) -> Dict[str, Any]:
+        return {
+            "leased": sum(1 for entry in self.pool.entries if entry.leased),
+            "contexts": len(self.pool.entries),
+            "size": self.pool.size,
+            "cpu_load": os.getloadavg()[0],
+        }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    worker = BrowserWorker(browser_pool)
+    asyncio.run(
+        worker.serve(
+            os.getenv("AURORA_WORKER_HOST", "127.0.0.1"),
+            int(os.getenv("AURORA_WORKER_PORT", "8100")),
+        )
+    )
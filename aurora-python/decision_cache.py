@@ -0,0 +1,118 @@
+import hashlib
+import logging
+import os
+import re
+from typing import Any, Dict, List
+from urllib.parse import urlsplit
+
+from sqlite_store import SqliteStore
+
+logger = logging.getLogger(__name__)
+
+# Attributes that identify an element across page loads. Values, states and
+# hrefs are left out because they change between visits to the same page.
+SIGNATURE_ATTRIBUTES = ("id", "name", "aria-label", "placeholder", "type", "role", "title", "alt")  # fmt: skip
+
+
+def normalize_description(description: str) -> str:
+    """Case-folded with whitespace collapsed. Descriptions never hold typed values."""
+    return " ".join(description.lower().split())
+
+
+def element_signature(element: Dict[str, Any]) -> Dict[str, Any]:
+    """The durable parts of an element record, used to find it again later."""
+    attributes = element.get("attributes", {})
+    return {
+        "tag": element.get("tag"),
+        "text": (element.get("text") or "").strip(),
+        "attributes": {
+            name: attributes[name]
+            for name in SIGNATURE_ATTRIBUTES
+            if name in attributes
+        },
+    }
+
+
+def page_fingerprint(url: str, kind: str, elements: List[Dict[str, Any]]) -> str:
+    """
+    A structural fingerprint of a page: its host, its path with ids and
+    numbers masked, and the set of element shapes (tag plus which identifying
+    attributes are present). Text and values are ignored, so the same login
+    form or search page fingerprints the same on every visit.
+    """
+    parts = urlsplit(url or "")
+    path = re.sub(r"/[^/]*\d[^/]*", "/:n", parts.path.rstrip("/"))
+    shapes = sorted(
+        {
+            element.get("tag", "")
+            + "["
+            + ",".join(
+                name
+                for name in SIGNATURE_ATTRIBUTES
+                if name in element.get("attributes", {})
+            )
+            + "]"
+            for element in elements
+        }
+    )
+    structure = "\n".join([parts.netloc, path, kind, *shapes])
+    return hashlib.blake2b(structure.encode(), digest_size=16).hexdigest()
+
+
+def resolve_signature(
+    signature: Dict[str, Any], elements: List[Dict[str, Any]]
+) -> Dict[str, Any] | None:
+    """The one freshly scanned element matching `signature`, or None if zero or several do."""
+    matches = [el for el in elements if element_signature(el) == signature]
+    return matches[0] if len(matches) == 1 else None
+
+
+class DecisionCache:
+    """
+    A persistent store of element resolutions keyed by page fingerprint and
+    the step's normalized element_description.
+
+    Entries expire `ttl` seconds after they were stored and the least
+    recently used ones are evicted beyond `max_entries`. A stored signature is
+    only a hint: callers validate it against the current element scan with
+    `resolve_signature` and report failures back through `invalidate`.
+    """
+
+    def __init__(self, path: str, ttl: float = 30 * 24 * 3600, max_entries: int = 4096):
+        self.stale = 0
+        self.store = SqliteStore(path, "decisions", ttl, max_entries)
+
+    @staticmethod
+    def _key(fingerprint: str, description: str) -> str:
+        # Fingerprints are hex digests, so the first ":" always ends one.
+        return f"{fingerprint}:{normalize_description(description)}"
+
+    def get(self, fingerprint: str, description: str) -> Dict[str, Any] | None:
+        """Returns the stored element signature, or None on a miss."""
+        hit = self.store.get(self._key(fingerprint, description))
+        return hit[1] if hit else None
+
+    def put(self, fingerprint: str, description: str, signature: Dict[str, Any]):
+        self.store.put(self._key(fingerprint, description), signature)
+
+    def invalidate(self, fingerprint: str, description: str):
+        """Drops an entry whose signature no longer matched or whose action failed."""
+        self.stale += 1
+        self.store.delete(self._key(fingerprint, description))
+
+    def stats(self) -> Dict[str, Any]:
+        hits, misses = self.store.hits, self.store.misses
+        lookups = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "stale": self.stale,
+            "hit_rate": (hits - self.stale) / lookups if lookups else 0.0,
+        }
+
+
+decision_cache = DecisionCache(
+    path=os.getenv("AURORA_DECISION_CACHE_PATH", "decision_cache.db"),
+    ttl=float(os.getenv("AURORA_DECISION_CACHE_TTL", str(30 * 24 * 3600))),
+    max_entries=int(os.getenv("AURORA_DECISION_CACHE_SIZE", "4096")),
+)
@@ -0,0 +1,114 @@
+import re
+from typing import Any, Dict, List, Tuple
+
+# How much a match in each element field counts towards its score.
+FIELD_WEIGHTS = {
+    "text": 3.0,
+    "aria-label": 3.0,
+    "placeholder": 2.5,
+    "value": 1.5,
+    "title": 1.5,
+    "name": 1.5,
+    "alt": 1.0,
+    "id": 1.0,
+    "role": 1.0,
+}
+QUOTED_PHRASE_BONUS = 2.0
+KIND_BONUS = 0.5
+
+# Words that describe what kind of element it is rather than which one.
+# Tags come from the DOM source, roles from the accessibility source.
+KIND_WORDS = {
+    "button": {"button"},
+    "link": {"a", "link"},
+    "field": {"input", "textarea", "textbox", "searchbox", "combobox"},
+    "input": {"input", "textarea", "textbox", "searchbox", "combobox"},
+    "box": {"input", "textarea", "textbox", "searchbox", "combobox"},
+    "textarea": {"textarea", "textbox"},
+    "checkbox": {"checkbox"},
+    "dropdown": {"select", "combobox"},
+    "tab": {"tab"},
+}
+STOPWORDS = {
+    "a", "an", "the", "with", "that", "this", "which", "says", "saying", "text",
+    "labeled", "labelled", "label", "element", "on", "of", "to", "in", "for",
+    "and", "or", "is", "it", "its", "at", "by", "from", "top", "bottom", "page",
+    "placeholder", "called", "named", "containing", "contains",
+}  # fmt: skip
+
+# A top match at or above this score, and ahead of the runner-up by at least
+# CONFIDENT_MARGIN, is taken without asking the decision agent.
+CONFIDENT_SCORE = 4.0
+CONFIDENT_MARGIN = 1.5
+
+
+def _tokens(value: str) -> set:
+    return set(re.findall(r"[a-z0-9]+", value.lower()))
+
+
+def _fields(element: Dict[str, Any]) -> Dict[str, str]:
+    attributes = element.get("attributes", {})
+    fields = {name: attributes[name] for name in FIELD_WEIGHTS if name in attributes}
+    fields["text"] = element.get("text", "")
+    return fields
+
+
+def score_element(element: Dict[str, Any], description: str) -> float:
+    """How well an extracted element matches a step's element_description."""
+    description_tokens = _tokens(description)
+    kinds = {
+        tag
+        for word in description_tokens & KIND_WORDS.keys()
+        for tag in KIND_WORDS[word]
+    }
+    wanted = description_tokens - STOPWORDS - KIND_WORDS.keys()
+    if not wanted:
+        wanted = description_tokens
+    if not wanted:
+        return 0.0
+
+    field_scores = []
+    for name, value in _fields(element).items():
+        field_tokens = _tokens(value)
+        overlap = len(wanted & field_tokens)
+        if not overlap:
+            continue
+        recall = overlap / len(wanted)
+        precision = overlap / len(field_tokens)
+        field_scores.append(FIELD_WEIGHTS[name] * (0.7 * recall + 0.3 * precision))
+    field_scores.sort(reverse=True)
+    score = sum(field_scores[:1]) + 0.25 * sum(field_scores[1:])
+
+    for phrase in re.findall(r"['\"]([^'\"]+)['\"]", description):
+        phrase = phrase.strip().lower()
+        if phrase and any(
+            phrase == value.strip().lower() for value in _fields(element).values()
+        ):
+            score += QUOTED_PHRASE_BONUS
+            break
+
+    role = element.get("attributes", {}).get("role", "")
+    if kinds and (element.get("tag") in kinds or role in kinds):
+        score += KIND_BONUS
+    return score
+
+
+def rank_elements(
+    elements: List[Dict[str, Any]], description: str
+) -> List[Tuple[float, Dict[str, Any]]]:
+    """Returns (score, element) pairs, best first. Ties keep document order."""
+    scored = [(score_element(element, description), element) for element in elements]
+    return sorted(scored, key=lambda pair: pair[0], reverse=True)
+
+
+def confident_match(
+    ranked: List[Tuple[float, Dict[str, Any]]],
+) -> Dict[str, Any] | None:
+    """The top element if it is an unambiguous match, otherwise None."""
+    if not ranked:
+        return None
+    top_score, top = ranked[0]
+    runner_up = ranked[1][0] if len(ranked) > 1 else 0.0
+    if top_score >= CONFIDENT_SCORE and top_score - runner_up >= CONFIDENT_MARGIN:
+        return top
+    return None
@@ -0,0 +1,146 @@
+import hashlib
+import io
+import struct
+import threading
+from typing import Dict, List, Tuple
+
+from PIL import Image
+
+# Wire format sent over /ws/agent (all integers big-endian):
+#   keyframe: B type=1, H width, H height, then the full JPEG
+#   delta:    B type=2, H width, H height, H tile_count, then per tile
+#             H x, H y, H w, H h, I jpeg_length followed by the tile JPEG
+KEYFRAME = 1
+DELTA = 2
+
+_KEYFRAME_HEADER = struct.Struct("!BHH")
+_DELTA_HEADER = struct.Struct("!BHHH")
+_TILE_HEADER = struct.Struct("!HHHHI")
+
+
+class Frame:
+    """
+    One encoded viewport frame. Decoding and per-tile hashing are done lazily
+    and at most once, so every viewer diffing against the same frame shares
+    the work.
+    """
+
+    def __init__(self, data: bytes, tile_size: int = 64, quality: int = 80):
+        self.data = data
+        self.digest = hashlib.blake2b(data, digest_size=16).digest()
+        self.tile_size = tile_size
+        self.quality = quality
+
+        self.width = 0
+        self.height = 0
+        self.tile_hashes: List[bytes] = []
+        self._image: Image.Image | None = None
+        self._tile_jpegs: Dict[int, bytes] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def columns(self) -> int:
+        return -(-self.width // self.tile_size)
+
+    def analyze(self):
+        """Decodes the JPEG and hashes every tile. Safe to call from a worker thread."""
+        with self._lock:
+            if self._image is not None:
+                return
+            image = Image.open(io.BytesIO(self.data))
+            image = image.convert("RGB")
+            self.width, self.height = image.size
+            self.tile_hashes = [
+                hashlib.blake2b(image.crop(box).tobytes(), digest_size=8).digest()
+                for box in self._tile_boxes()
+            ]
+            self._image = image
+
+    def tile_box(self, index: int) -> Tuple[int, int, int, int]:
+        x = (index % self.columns) * self.tile_size
+        y = (index // self.columns) * self.tile_size
+        return (
+            x,
+            y,
+            min(x + self.tile_size, self.width),
+            min(y + self.tile_size, self.height),
+        )
+
+    def tile_jpeg(self, index: int) -> bytes:
+        with self._lock:
+            if index not in self._tile_jpegs:
+                buffer = io.BytesIO()
+                self._image.crop(self.tile_box(index)).save(
+                    buffer, format="JPEG", quality=self.quality
+                )
+                self._tile_jpegs[index] = buffer.getvalue()
+            return self._tile_jpegs[index]
+
+    def _tile_boxes(self):
+        rows = -(-self.height // self.tile_size)
+        for index in range(rows * self.columns):
+            yield self.tile_box(index)
+
+
+class FrameEncoder:
+    """
+    Turns a viewer's stream of frames into wire messages relative to the last
+    frame that viewer actually received: nothing for a duplicate, only the
+    changed tiles when a small part of the viewport moved, and a keyframe
+    otherwise.
+    """
+
+    def __init__(self, max_delta_ratio: float = 0.5):
+        self.max_delta_ratio = max_delta_ratio
+        self.last_frame: Frame | None = None
+        self.keyframes = 0
+        self.deltas = 0
+        self.duplicates = 0
+
+    def encode(self, frame: Frame) -> bytes | None:
+        """Returns the message to send, or None when the frame adds nothing new."""
+        previous = self.last_frame
+        if previous is not None and previous.digest == frame.digest:
+            self.duplicates += 1
+            return None
+
+        frame.analyze()
+        self.last_frame = frame
+
+        if (
+            previous is None
+            or (previous.width, previous.height) != (frame.width, frame.height)
+            or previous.tile_size != frame.tile_size
+        ):
+            return self._keyframe(frame)
+
+        changed = [
+            index
+            for index, tile_hash in enumerate(frame.tile_hashes)
+            if tile_hash != previous.tile_hashes[index]
+        ]
+        if not changed:
+            self.duplicates += 1
+            return None
+        if len(changed) > len(frame.tile_hashes) * self.max_delta_ratio:
+            return self._keyframe(frame)
+
+        self.deltas += 1
+        parts = [_DELTA_HEADER.pack(DELTA, frame.width, frame.height, len(changed))]
+        for index in changed:
+            x0, y0, x1, y1 = frame.tile_box(index)
+            tile = frame.tile_jpeg(index)
+            parts.append(_TILE_HEADER.pack(x0, y0, x1 - x0, y1 - y0, len(tile)))
+            parts.append(tile)
+        return b"".join(parts)
+
+    def _keyframe(self, frame: Frame) -> bytes:
+        self.keyframes += 1
+        return _KEYFRAME_HEADER.pack(KEYFRAME, frame.width, frame.height) + frame.data
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "keyframes": self.keyframes,
+            "deltas": self.deltas,
+            "duplicates": self.duplicates,
+        }
@@ -0,0 +1,53 @@
+import logging
+import os
+from typing import Any, Dict, List
+
+from sqlite_store import SqliteStore
+
+logger = logging.getLogger(__name__)
+
+
+def macro_key(user_id: str, query: str) -> str:
+    """
+    The user and the query with whitespace collapsed and nothing else changed.
+    Case and punctuation stay, since they may be part of a value the macro
+    types, and the user is part of it so one client's typed values are never
+    replayed for another.
+    """
+    return f"{user_id}\n{' '.join(query.split())}"
+
+
+class MacroStore:
+    """
+    A persistent store of recorded runs, keyed by user and exact query.
+
+    A macro is the list of steps a run completed, each with the page
+    fingerprint it was performed on and the signature of the element it
+    acted on, so it can be replayed without any model calls. Only exact query
+    matches are replayed since macros carry concrete typed values; see
+    `macro_key`.
+    """
+
+    def __init__(self, path: str, ttl: float = 30 * 24 * 3600, max_entries: int = 256):
+        self.store = SqliteStore(path, "macros", ttl, max_entries)
+
+    def get(self, user_id: str, query: str) -> List[Dict[str, Any]] | None:
+        """Returns the user's recorded steps for the query, or None on a miss."""
+        hit = self.store.get(macro_key(user_id, query))
+        return hit[1] if hit else None
+
+    def put(self, user_id: str, query: str, steps: List[Dict[str, Any]]):
+        self.store.put(macro_key(user_id, query), steps)
+
+    def invalidate(self, user_id: str, query: str):
+        self.store.delete(macro_key(user_id, query))
+
+    def stats(self) -> Dict[str, int]:
+        return self.store.stats()
+
+
+macro_store = MacroStore(
+    path=os.getenv("AURORA_MACRO_PATH", "macros.db"),
+    ttl=float(os.getenv("AURORA_MACRO_TTL", str(30 * 24 * 3600))),
+    max_entries=int(os.getenv("AURORA_MACRO_SIZE", "256")),
+)
@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import os
+import re
+import time
+from typing import Any, Dict
+from urllib.parse import urlsplit
+
+from playwright.async_api import Page, Request
+
+from page_scripts import QUIET_FOR_SCRIPT
+
+logger = logging.getLogger(__name__)
+
+# Requests that never settle on their own and say nothing about whether the
+# page is ready.
+IGNORED_RESOURCE_TYPES = {"websocket", "eventsource", "manifest"}
+ANALYTICS_URL_PATTERN = re.compile(
+    r"google-analytics\.com|googletagmanager\.com|doubleclick\.net|"
+    r"facebook\.com/tr|hotjar\.com|segment\.(io|com)|mixpanel\.com|"
+    r"clarity\.ms|newrelic\.com|nr-data\.net|sentry\.io|/collect\b|/beacon\b",
+    re.IGNORECASE,
+)
+# A request still open after this long is assumed to be a long-poll.
+LONG_POLL_AGE = 5.0
+POLL_INTERVAL = 0.05
+
+
+class NetworkTracker:
+    """Counts a page's in-flight requests that readiness should wait for."""
+
+    def __init__(self, page: Page):
+        self._in_flight: Dict[Request, float] = {}
+        self.last_activity = time.monotonic()
+        page.on("request", self._on_request)
+        page.on("requestfinished", self._on_done)
+        page.on("requestfailed", self._on_done)
+
+    def _on_request(self, request: Request):
+        if request.resource_type in IGNORED_RESOURCE_TYPES:
+            return
+        if ANALYTICS_URL_PATTERN.search(request.url):
+            return
+        self._in_flight[request] = time.monotonic()
+        self.last_activity = time.monotonic()
+
+    def _on_done(self, request: Request):
+        if self._in_flight.pop(request, None) is not None:
+            self.last_activity = time.monotonic()
+
+    def pending(self) -> int:
+        now = time.monotonic()
+        return sum(
+            1 for started in self._in_flight.values() if now - started < LONG_POLL_AGE
+        )
+
+
+class PageReadiness:
+    """
+    Decides when a page has settled after a navigation or an action: no
+    relevant requests in flight and no DOM mutation, layout shift or height
+    change for `quiet_period` seconds.
+
+    How long that takes is learned per domain as a moving average, and each
+    wait gets a budget of a few times the usual settle time, clamped between
+    `min_budget` and `max_budget`. Running out of budget is not an error; the
+    caller just proceeds on a page that is still busy. Such waits are not
+    learned, since they only show the budget; instead each one in a row
+    halves the domain's next budget, so a page that never goes quiet stops
+    costing the full budget after every action.
+    """
+
+    def __init__(
+        self,
+        quiet_period: float = 0.3,
+        min_budget: float = 1.0,
+        max_budget: float = 10.0,
+        default_budget: float = 5.0,
+    ):
+        self.quiet_period = quiet_period
+        self.min_budget = min_budget
+        self.max_budget = max_budget
+        self.default_budget = default_budget
+        # domain -> moving average of observed settle times, in seconds.
+        self.profiles: Dict[str, float] = {}
+        # domain -> waits in a row that ran out of budget.
+        self.timeouts: Dict[str, int] = {}
+
+    def budget_for(self, url: str) -> float:
+        domain = urlsplit(url).netloc
+        usual = self.profiles.get(domain)
+        if usual is None:
+            budget = min(self.default_budget, self.max_budget)
+        else:
+            budget = min(self.max_budget, 3 * usual + self.quiet_period)
+        return max(self.min_budget, budget / 2 ** self.timeouts.get(domain, 0))
+
+    def _learn(self, url: str, waited: float):
+        domain = urlsplit(url).netloc
+        usual = self.profiles.get(domain)
+        self.profiles[domain] = waited if usual is None else 0.7 * usual + 0.3 * waited
+        self.timeouts.pop(domain, None)
+
+    def _timed_out(self, url: str):
+        domain = urlsplit(url).netloc
+        self.timeouts[domain] = self.timeouts.get(domain, 0) + 1
+
+    async def wait(self, page: Page, network: NetworkTracker) -> Dict[str, Any]:
+        """Waits for the page to settle. Returns how long that took and whether it did."""
+        budget = self.budget_for(page.url)
+        started = time.monotonic()
+        while True:
+            waited = time.monotonic() - started
+            # The action itself counts as a change, so the page always gets
+            # one quiet period to start reacting to it.
+            if waited >= self.quiet_period and await self._is_quiet(page, network):
+                break
+            if waited >= budget:
+                logger.warning(
+                    f"--- Page on {urlsplit(page.url).netloc} still busy after {budget:.1f}s "
+                    f"({network.pending()} requests in flight) ---"
+                )
+                self._timed_out(page.url)
+                return {"waited": waited, "settled": False, "budget": budget}
+            await asyncio.sleep(POLL_INTERVAL)
+
+        self._learn(page.url, waited)
+        return {"waited": waited, "settled": True, "budget": budget}
+
+    async def _is_quiet(self, page: Page, network: NetworkTracker) -> bool:
+        if network.pending():
+            return False
+        if time.monotonic() - network.last_activity < self.quiet_period:
+            return False
+        try:
+            quiet_for = await page.evaluate(QUIET_FOR_SCRIPT)
+        except Exception:
+            # The document is being replaced mid-navigation.
+            return False
+        return quiet_for >= self.quiet_period * 1000
+
+
+page_readiness = PageReadiness(
+    quiet_period=float(os.getenv("AURORA_READY_QUIET_MS", "300")) / 1000,
+    max_budget=float(os.getenv("AURORA_READY_MAX_BUDGET", "10")),
+)
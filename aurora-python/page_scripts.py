@@ -0,0 +1,315 @@
+# JavaScript snippets evaluated inside the agent's page by BrowserManager.
+
+ELEMENT_ID_ATTRIBUTE = "data-aurora-id"
+
+# Installs a page-side index of interactive elements. A MutationObserver keeps
+# one Set per selector kind up to date as nodes are added or removed, and bumps
+# `version` whenever something that could change the element table happens.
+# `docId` changes with every new document, so (docId, version) identifies one
+# exact state of the table. Installed as an init script on every document, and
+# lazily by EXTRACT_ELEMENTS_SCRIPT if the init script did not run.
+#
+# Open shadow roots are indexed and observed like the document itself,
+# including roots attached after the index was installed. Closed roots stay
+# out of reach, as they are for Playwright's locators.
+INSTALL_INDEX_SCRIPT = """
+(selectors) => {
+  if (window.__auroraIndex) return window.__auroraIndex;
+
+  const kinds = Object.entries(selectors);
+  const index = {
+    docId: Math.random().toString(36).slice(2) + Date.now().toString(36),
+    version: 0,
+    added: 0,
+    removed: 0,
+    sets: Object.fromEntries(kinds.map(([kind]) => [kind, new Set()])),
+  };
+  const anySelector = kinds.map(([, selector]) => selector).join(", ");
+  const observerOptions = {
+    childList: true,
+    subtree: true,
+    characterData: true,
+    attributes: true,
+    attributeFilter: [
+      "class", "style", "hidden", "open", "type", "role", "disabled", "href",
+      "name", "placeholder", "value", "aria-label", "aria-hidden", "aria-expanded",
+    ],
+  };
+
+  const observed = new WeakSet();
+  const observe = (root) => {
+    if (observed.has(root)) return;
+    observed.add(root);
+    observer.observe(root, observerOptions);
+  };
+  // `root` plus every open shadow root inside it, at any depth.
+  const treesIn = (root) => {
+    const trees = [root];
+    for (let i = 0; i < trees.length; i++) {
+      const tree = trees[i];
+      if (tree.shadowRoot) trees.push(tree.shadowRoot);
+      for (const el of tree.querySelectorAll("*")) {
+        if (el.shadowRoot) trees.push(el.shadowRoot);
+      }
+    }
+    return trees;
+  };
+  // Element.closest, continuing past shadow hosts.
+  const insideInteractive = (el) => {
+    for (let node = el; node; node = node.getRootNode().host) {
+      if (node.closest(anySelector)) return true;
+    }
+    return false;
+  };
+
+  const track = (root) => {
+    let changed = false;
+    for (const tree of treesIn(root)) {
+      if (tree instanceof ShadowRoot) observe(tree);
+      for (const [kind, selector] of kinds) {
+        const set = index.sets[kind];
+        const found = Array.from(tree.querySelectorAll(selector));
+        if (tree.nodeType === Node.ELEMENT_NODE && tree.matches(selector)) {
+          found.push(tree);
+        }
+        for (const el of found) {
+          if (!set.has(el)) {
+            set.add(el);
+            index.added++;
+            changed = true;
+          }
+        }
+      }
+    }
+    return changed;
+  };
+  const retest = (el) => {
+    let changed = false;
+    for (const [kind, selector] of kinds) {
+      const set = index.sets[kind];
+      const matches = el.matches(selector);
+      if (matches && !set.has(el)) {
+        set.add(el);
+        index.added++;
+        changed = true;
+      } else if (!matches && set.delete(el)) {
+        index.removed++;
+        changed = true;
+      }
+    }
+    return changed;
+  };
+  // Detached subtrees can still be queried, so removals are detected cheaply
+  // here and the Sets are pruned of disconnected nodes at scan time.
+  const holdsInteractive = (root) =>
+    root.matches(anySelector) ||
+    treesIn(root).some((tree) => tree.querySelector(anySelector) !== null);
+
+  const observer = new MutationObserver((mutations) => {
+    let changed = false;
+    for (const mutation of mutations) {
+      if (mutation.type === "childList") {
+        for (const node of mutation.addedNodes) {
+          if (node.nodeType === Node.ELEMENT_NODE && track(node)) changed = true;
+        }
+        for (const node of mutation.removedNodes) {
+          if (node.nodeType === Node.ELEMENT_NODE && holdsInteractive(node)) {
+            changed = true;
+          }
+        }
+        const target = mutation.target;
+        const parent = target instanceof ShadowRoot ? target.host : target;
+        if (parent.nodeType === Node.ELEMENT_NODE && insideInteractive(parent)) {
+          changed = true;
+        }
+      } else if (mutation.type === "attributes") {
+        // Visibility and labelling attributes can change anywhere above an
+        // element, so every filtered attribute change invalidates the table.
+        retest(mutation.target);
+        changed = true;
+      } else if (mutation.type === "characterData") {
+        const parent = mutation.target.parentElement;
+        if (parent && insideInteractive(parent)) changed = true;
+      }
+    }
+    if (changed) index.version++;
+  });
+  observe(document);
+  if (document.documentElement) track(document.documentElement);
+
+  // Shadow roots attached from now on are observed as soon as they exist.
+  const attachShadow = Element.prototype.attachShadow;
+  Element.prototype.attachShadow = function (init) {
+    const shadow = attachShadow.call(this, init);
+    if (init && init.mode === "open") {
+      observe(shadow);
+      index.version++;
+    }
+    return shadow;
+  };
+
+  index.prune = () => {
+    for (const set of Object.values(index.sets)) {
+      for (const el of set) {
+        if (!el.isConnected) {
+          set.delete(el);
+          index.removed++;
+        }
+      }
+    }
+  };
+  window.__auroraIndex = index;
+  return index;
+}
+"""
+
+# Returns the page's current (docId, version) and, only if that differs from
+# `known`, the full element table for every selector kind. Everything the LLM
+# needs comes back in this single round trip. Each element is tagged with a
+# stable numeric id stored in `idAttribute`, so later actions can find it again
+# with a plain attribute selector and repeated scans keep their ids.
+EXTRACT_ELEMENTS_SCRIPT = (
+    """
+({ selectors, idAttribute, known }) => {
+  const index = window.__auroraIndex || ("""
+    + INSTALL_INDEX_SCRIPT.strip()
+    + """)(selectors);
+  const state = { docId: index.docId, version: index.version };
+  if (known && known.docId === state.docId && known.version === state.version) {
+    return { state, elements: null };
+  }
+  index.prune();
+
+  const owners = new Map();
+  const assignId = (el) => {
+    let id = el.getAttribute(idAttribute);
+    // Nodes cloned by the page carry their source's id; give them their own.
+    if (id === null || (owners.has(id) && owners.get(id) !== el)) {
+      window.__auroraNextId = (window.__auroraNextId || 0) + 1;
+      id = String(window.__auroraNextId - 1);
+      el.setAttribute(idAttribute, id);
+    }
+    owners.set(id, el);
+    return Number(id);
+  };
+  const isVisible = (el, rect) => {
+    if (rect.width === 0 || rect.height === 0) return false;
+    return window.getComputedStyle(el).visibility !== "hidden";
+  };
+  // The element and the shadow hosts it sits under, outermost first.
+  const hostChain = (el) => {
+    const chain = [el];
+    for (let root = el.getRootNode(); root instanceof ShadowRoot; root = root.host.getRootNode()) {
+      chain.unshift(root.host);
+    }
+    return chain;
+  };
+  // Document order across shadow roots: compares the first hosts that
+  // differ, which always share a tree; a host comes before its contents.
+  const inDocumentOrder = (a, b) => {
+    const chainA = hostChain(a);
+    const chainB = hostChain(b);
+    let i = 0;
+    while (i < chainA.length && i < chainB.length && chainA[i] === chainB[i]) i++;
+    if (i === chainA.length) return -1;
+    if (i === chainB.length) return 1;
+    return chainA[i].compareDocumentPosition(chainB[i]) & Node.DOCUMENT_POSITION_FOLLOWING ? -1 : 1;
+  };
+
+  const describe = (el) => {
+    const rect = el.getBoundingClientRect();
+    const attributes = {};
+    for (const attr of el.attributes) {
+      if (attr.name !== idAttribute) attributes[attr.name] = attr.value;
+    }
+    return {
+      id: assignId(el),
+      visible: isVisible(el, rect),
+      tag: el.tagName.toLowerCase(),
+      text: (el.innerText || "").trim(),
+      attributes,
+      bbox: {
+        x: Math.round(rect.x),
+        y: Math.round(rect.y),
+        width: Math.round(rect.width),
+        height: Math.round(rect.height),
+      },
+    };
+  };
+
+  const elements = {};
+  for (const [kind, set] of Object.entries(index.sets)) {
+    elements[kind] = Array.from(set).sort(inDocumentOrder).map(describe);
+  }
+  return { state, elements };
+}
+"""
+)
+
+# Returns the page's current (docId, version), installing the index first if
+# the init script did not run.
+INDEX_STATE_SCRIPT = (
+    """
+(selectors) => {
+  const index = window.__auroraIndex || ("""
+    + INSTALL_INDEX_SCRIPT.strip()
+    + """)(selectors);
+  return { docId: index.docId, version: index.version };
+}
+"""
+)
+
+# Elements found through the accessibility tree are tagged with their own
+# attribute on demand, right before an action, so Playwright can locate them.
+AX_ID_ATTRIBUTE = "data-aurora-ax-id"
+
+TAG_NODE_FUNCTION = """
+function (attribute, id) {
+  this.setAttribute(attribute, id);
+}
+"""
+
+# Records when the page last visibly changed: nodes or text added, removed or
+# edited, or a layout shift reported by the browser. Attribute changes alone
+# are ignored, since carousels, timers and spinners toggle classes and styles
+# forever; the ones that move content still show up as layout shifts. Installed as an init script on every
+# document, and lazily by QUIET_FOR_SCRIPT.
+INSTALL_ACTIVITY_SCRIPT = """
+() => {
+  if (window.__auroraActivity) return window.__auroraActivity;
+
+  const activity = { lastChange: performance.now(), height: 0 };
+  const touch = () => { activity.lastChange = performance.now(); };
+  new MutationObserver(touch).observe(document, {
+    childList: true,
+    subtree: true,
+    characterData: true,
+  });
+  try {
+    new PerformanceObserver(touch).observe({ type: "layout-shift", buffered: false });
+  } catch (e) {
+    // Layout-shift entries are Chromium-only; mutations still count.
+  }
+  window.__auroraActivity = activity;
+  return activity;
+}
+"""
+
+# Milliseconds since the page last changed. A change in document height counts
+# as a change too, which catches layout that settles without mutations
+# (images and fonts arriving, for example).
+QUIET_FOR_SCRIPT = (
+    """
+() => {
+  const activity = window.__auroraActivity || ("""
+    + INSTALL_ACTIVITY_SCRIPT.strip()
+    + """)();
+  const height = document.documentElement ? document.documentElement.scrollHeight : 0;
+  if (height !== activity.height) {
+    activity.height = height;
+    activity.lastChange = performance.now();
+  }
+  return performance.now() - activity.lastChange;
+}
+"""
+)
@@ -0,0 +1,116 @@
+import logging
+import os
+import re
+from typing import Any, Dict, Iterable, Tuple
+
+from sqlite_store import SqliteStore
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(query: str) -> str:
+    """
+    The exact cache key: the query with whitespace collapsed. Case and
+    symbols are kept because plans carry the values typed from the query,
+    and "C++" and "C#" must not share a plan.
+    """
+    return " ".join(query.split())
+
+
+def _words(query: str) -> set:
+    return set(re.findall(r"[\w+#]+", query.lower()))
+
+
+def _similarity(a: str, b: str) -> float:
+    """Jaccard similarity of the two queries' case-folded word sets."""
+    words_a, words_b = _words(a), _words(b)
+    if not words_a or not words_b:
+        return 0.0
+    return len(words_a & words_b) / len(words_a | words_b)
+
+
+def _types_values(plan: Dict[str, Any]) -> bool:
+    return any(step.get("interaction_type") == "type" for step in plan.get("steps", []))
+
+
+class PlanCache:
+    """
+    A persistent plan store keyed by user and query, see `normalize_query`.
+    Plans are built from the session's history and carry the values typed
+    from the query, so they are never shared between users.
+
+    Entries expire `ttl` seconds after they were stored and the least recently
+    used ones are evicted beyond `max_entries`. If `similarity_threshold` is
+    set, a query with no exact match can also reuse the plan of the same
+    user's most similar stored query at or above that threshold, unless that
+    plan types anything: "password hunter2" and "password hunter3" are
+    similar queries with different values.
+
+    Plans are stored as plain dicts; validating them back into `Plan` objects
+    is left to the caller so this module has no dependency on the agents.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        ttl: float = 7 * 24 * 3600,
+        max_entries: int = 512,
+        similarity_threshold: float | None = None,
+    ):
+        self.similarity_threshold = similarity_threshold
+        self.store = SqliteStore(path, "plans", ttl, max_entries)
+
+    @staticmethod
+    def _key(user_id: str, query: str) -> str:
+        # Normalized queries hold no newlines, so the first one ends the user.
+        return f"{user_id}\n{normalize_query(query)}"
+
+    def get(self, user_id: str, query: str) -> Tuple[str, Dict[str, Any]] | None:
+        """Returns the matched key and its plan, or None on a miss."""
+        key = self._key(user_id, query)
+        fallback = (
+            (lambda items: self._most_similar(key, items))
+            if self.similarity_threshold
+            else None
+        )
+        hit = self.store.get(key, fallback)
+        if hit and hit[0] != key:
+            logger.info(f"--- Plan cache matched {key!r} to similar {hit[0]!r} ---")
+        return hit
+
+    def put(self, user_id: str, query: str, plan: Dict[str, Any]) -> str:
+        """Stores the plan and returns the key it was stored under."""
+        key = self._key(user_id, query)
+        self.store.put(key, plan)
+        return key
+
+    def invalidate(self, key: str):
+        """Drops the entry stored under `key`, as returned by `get`."""
+        self.store.delete(key)
+
+    def stats(self) -> Dict[str, int]:
+        return self.store.stats()
+
+    def _most_similar(
+        self, key: str, items: Iterable[Tuple[str, Dict[str, Any]]]
+    ) -> str | None:
+        user, query = key.split("\n", 1)
+        best, best_score = None, self.similarity_threshold
+        for candidate, plan in items:
+            candidate_user, candidate_query = candidate.split("\n", 1)
+            if candidate_user != user or _types_values(plan):
+                continue
+            score = _similarity(query, candidate_query)
+            if score >= best_score:
+                best, best_score = candidate, score
+        return best
+
+
+_similarity_env = os.getenv("AURORA_PLAN_CACHE_SIMILARITY")
+
+plan_cache = PlanCache(
+    path=os.getenv("AURORA_PLAN_CACHE_PATH", "plan_cache.db"),
+    ttl=float(os.getenv("AURORA_PLAN_CACHE_TTL", str(7 * 24 * 3600))),
+    max_entries=int(os.getenv("AURORA_PLAN_CACHE_SIZE", "512")),
+    similarity_threshold=float(_similarity_env) if _similarity_env else None,
+)
@@ -0,0 +1,28 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator
+
+# Receives the progress events of the run in progress, if anyone is listening.
+_listener: ContextVar[Callable[[Dict[str, Any]], None] | None] = ContextVar(
+    "progress_listener", default=None
+)
+
+
+@contextmanager
+def listen(callback: Callable[[Dict[str, Any]], None]) -> Iterator[None]:
+    """Sends every progress event emitted in this context to `callback`."""
+    token = _listener.set(callback)
+    try:
+        yield
+    finally:
+        _listener.reset(token)
+
+
+def emit(event_type: str, **data: Any):
+    """
+    Reports a milestone of the run (plan ready, step started or finished)
+    to the listener, if any. Must not block, so callbacks only queue.
+    """
+    listener = _listener.get()
+    if listener:
+        listener({"type": event_type, **data})
@@ -0,0 +1,276 @@
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Iterable
+from urllib.parse import urlsplit
+
+from playwright.async_api import Route
+
+logger = logging.getLogger(__name__)
+
+# Ad, tracking and analytics hosts; subdomains are blocked too.
+DEFAULT_BLOCKED_DOMAINS = (
+    "doubleclick.net",
+    "googlesyndication.com",
+    "googleadservices.com",
+    "google-analytics.com",
+    "googletagmanager.com",
+    "adservice.google.com",
+    "facebook.net",
+    "hotjar.com",
+    "segment.io",
+    "segment.com",
+    "mixpanel.com",
+    "clarity.ms",
+    "scorecardresearch.com",
+    "quantserve.com",
+    "taboola.com",
+    "outbrain.com",
+    "criteo.com",
+    "adnxs.com",
+    "amazon-adsystem.com",
+    "newrelic.com",
+    "nr-data.net",
+)
+# Rough transfer sizes, used to estimate what a blocked request would have cost.
+ESTIMATED_BYTES = {"image": 40_000, "media": 500_000, "font": 40_000}
+DEFAULT_ESTIMATED_BYTES = 20_000
+CACHEABLE_RESOURCE_TYPES = {"script", "stylesheet", "font", "image"}
+
+
+def _env_list(name: str, default: Iterable[str]) -> set:
+    value = os.getenv(name)
+    if value is None:
+        return set(default)
+    return {item.strip().lower() for item in value.split(",") if item.strip()}
+
+
+def _lifetime(headers: Dict[str, str]) -> float | None:
+    """
+    How many more seconds a shared cache may serve the response, from
+    s-maxage, max-age or Expires less its Age, or None if it does not say.
+    """
+    cache_control = headers.get("cache-control", "").lower()
+    age = float(headers["age"]) if headers.get("age", "").isdigit() else 0.0
+    for directive in ("s-maxage", "max-age"):
+        match = re.search(rf"(?:^|[\s,]){directive}=\"?(\d+)", cache_control)
+        if match:
+            return float(match.group(1)) - age
+    if "expires" not in headers:
+        return None
+    try:
+        expires = parsedate_to_datetime(headers["expires"])
+        date = (
+            parsedate_to_datetime(headers["date"])
+            if "date" in headers
+            else datetime.now(timezone.utc)
+        )
+        return (expires - date).total_seconds() - age
+    except (TypeError, ValueError):
+        # An invalid Expires means already expired.
+        return 0.0
+
+
+class HttpCache:
+    """
+    An in-memory LRU of static GET responses, shared by every browser context
+    so a script or stylesheet fetched by one agent is served locally to the
+    rest. Only responses that HTTP caching would allow a shared cache to keep
+    are stored, and only for as long as their max-age or Expires allows.
+    Responses without explicit freshness, or that vary on anything but their
+    encoding, are not kept, since they are not known to be the same for every
+    user and every visit.
+    """
+
+    def __init__(
+        self, max_bytes: int = 64 * 1024 * 1024, max_entry_bytes: int = 2 * 1024 * 1024
+    ):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.size = 0
+        self._entries: OrderedDict[str, Dict[str, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, url: str) -> Dict[str, Any] | None:
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is None:
+                return None
+            if entry["expires_at"] <= time.monotonic():
+                del self._entries[url]
+                self.size -= len(entry["body"])
+                return None
+            self._entries.move_to_end(url)
+            return entry
+
+    def put(
+        self,
+        url: str,
+        status: int,
+        headers: Dict[str, str],
+        body: bytes,
+        request_headers: Dict[str, str] | None = None,
+    ):
+        if status != 200 or len(body) > self.max_entry_bytes:
+            return
+        cache_control = headers.get("cache-control", "").lower()
+        if (
+            re.search(r"no-store|no-cache|private", cache_control)
+            or "set-cookie" in headers
+        ):
+            return
+        vary = {
+            field.strip().lower()
+            for field in headers.get("vary", "").split(",")
+            if field.strip()
+        }
+        if vary - {"accept-encoding"}:
+            return
+        # Authorized responses are per user unless explicitly shareable.
+        if "authorization" in (request_headers or {}) and not re.search(
+            r"public|s-maxage", cache_control
+        ):
+            return
+        lifetime = _lifetime(headers)
+        if not lifetime or lifetime <= 0:
+            return
+        entry = {
+            "status": status,
+            "headers": headers,
+            "body": body,
+            "expires_at": time.monotonic() + lifetime,
+        }
+        with self._lock:
+            old = self._entries.pop(url, None)
+            if old:
+                self.size -= len(old["body"])
+            self._entries[url] = entry
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted["body"])
+
+
+class RequestPolicy:
+    """
+    Decides what an agent page may load: requests of a blocked resource type
+    or to a blocked domain are aborted, and cacheable static responses are
+    served from the shared `HttpCache` when one is given.
+    """
+
+    def __init__(
+        self,
+        blocked_resource_types: Iterable[str] = (),
+        blocked_domains: Iterable[str] = (),
+        cache: HttpCache | None = None,
+    ):
+        self.blocked_resource_types = set(blocked_resource_types)
+        self.blocked_domains = set(blocked_domains)
+        self.cache = cache
+
+    @property
+    def active(self) -> bool:
+        return bool(self.blocked_resource_types or self.blocked_domains or self.cache)
+
+    def blocks(self, resource_type: str, url: str) -> bool:
+        if resource_type in self.blocked_resource_types:
+            return True
+        host = (urlsplit(url).hostname or "").lower()
+        return any(
+            host == domain or host.endswith("." + domain)
+            for domain in self.blocked_domains
+        )
+
+    async def handle(self, route: Route, stats: "RequestStats"):
+        """The route handler body; `stats` collects what the policy saved."""
+        request = route.request
+        # Never block the page itself, only what it pulls in.
+        if request.resource_type != "document" and self.blocks(
+            request.resource_type, request.url
+        ):
+            stats.blocked(request.resource_type)
+            await route.abort("blockedbyclient")
+            return
+
+        if (
+            not self.cache
+            or request.method != "GET"
+            or request.resource_type not in CACHEABLE_RESOURCE_TYPES
+        ):
+            await route.continue_()
+            return
+
+        cached = self.cache.get(request.url)
+        if cached:
+            stats.served_from_cache(len(cached["body"]))
+            await route.fulfill(
+                status=cached["status"], headers=cached["headers"], body=cached["body"]
+            )
+            return
+
+        try:
+            response = await route.fetch()
+            body = await response.body()
+        except Exception as e:
+            logger.debug(f"Fetch for {request.url} failed: {e}")
+            await route.abort()
+            return
+        self.cache.put(
+            request.url, response.status, response.headers, body, request.headers
+        )
+        await route.fulfill(response=response, body=body)
+
+
+class RequestStats:
+    """What a browser's request policy saved since the counters were last taken."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.blocked_requests = 0
+        self.blocked_bytes_estimate = 0
+        self.blocked_by_type: Dict[str, int] = {}
+        self.cache_hits = 0
+        self.cache_bytes = 0
+
+    def blocked(self, resource_type: str):
+        self.blocked_requests += 1
+        self.blocked_bytes_estimate += ESTIMATED_BYTES.get(
+            resource_type, DEFAULT_ESTIMATED_BYTES
+        )
+        self.blocked_by_type[resource_type] = (
+            self.blocked_by_type.get(resource_type, 0) + 1
+        )
+
+    def served_from_cache(self, size: int):
+        self.cache_hits += 1
+        self.cache_bytes += size
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "blocked_requests": self.blocked_requests,
+            "blocked_bytes_estimate": self.blocked_bytes_estimate,
+            "blocked_by_type": dict(self.blocked_by_type),
+            "cache_hits": self.cache_hits,
+            "cache_bytes": self.cache_bytes,
+        }
+
+
+# Resource types are only blocked on request, e.g. "image,media,font": doing
+# so changes what the live view shows and can shrink icon-only links to
+# nothing, which the element scan then drops as invisible.
+request_policy = RequestPolicy(
+    blocked_resource_types=_env_list("AURORA_BLOCK_RESOURCE_TYPES", ()),
+    blocked_domains=_env_list("AURORA_BLOCK_DOMAINS", DEFAULT_BLOCKED_DOMAINS),
+    cache=(
+        HttpCache(max_bytes=int(os.getenv("AURORA_HTTP_CACHE_MB", "64")) * 1024 * 1024)
+        if os.getenv("AURORA_HTTP_CACHE", "0") == "1"
+        else None
+    ),
+)
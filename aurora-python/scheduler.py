@@ -0,0 +1,153 @@
+import asyncio
+import logging
+import os
+from collections import OrderedDict, deque
+from typing import AsyncIterator, Deque, Set
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Raised when a run cannot even be queued and should be rejected outright."""
+
+
+class RunTicket:
+    """One /api/chat run, from admission request until it finishes."""
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        self.admitted = asyncio.Event()
+        self.released = False
+
+
+class RunScheduler:
+    """
+    Admission control in front of agent runs.
+
+    At most `max_concurrent` runs execute at once, and at most one per user:
+    a user's runs share one browser context, so a second one admitted would
+    only hold a slot while it waits for the first. Waiting runs are served
+    round-robin across users, so one user with many queued requests cannot
+    starve the others. The queue is bounded both overall and per user, and
+    enqueue fails immediately when either bound is hit.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = 4,
+        max_queue: int = 32,
+        max_queued_per_user: int = 3,
+        position_interval: float = 2.0,
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_queued_per_user = max_queued_per_user
+        self.position_interval = position_interval
+
+        self.running = 0
+        self.queued = 0
+        # Users with a run executing.
+        self.active: Set[str] = set()
+        # Users with waiting runs, in the order they will next be served.
+        self.queues: "OrderedDict[str, Deque[RunTicket]]" = OrderedDict()
+
+    def enqueue(self, user_id: str) -> RunTicket:
+        if self.queued >= self.max_queue:
+            raise QueueFullError("The agent is at capacity. Please try again shortly.")
+        user_queue = self.queues.get(user_id)
+        if user_queue and len(user_queue) >= self.max_queued_per_user:
+            raise QueueFullError(
+                "You already have too many requests waiting. Please wait for them to finish."
+            )
+
+        ticket = RunTicket(user_id)
+        self.queues.setdefault(user_id, deque()).append(ticket)
+        self.queued += 1
+        self._dispatch()
+        return ticket
+
+    async def wait(self, ticket: RunTicket) -> AsyncIterator[int]:
+        """Yields the ticket's queue position whenever it changes, until admitted."""
+        last_position = None
+        while not ticket.admitted.is_set():
+            position = self.position(ticket)
+            if position != last_position:
+                last_position = position
+                yield position
+            try:
+                await asyncio.wait_for(
+                    ticket.admitted.wait(), timeout=self.position_interval
+                )
+            except asyncio.TimeoutError:
+                pass
+
+    def position(self, ticket: RunTicket) -> int:
+        """1-based position in service order, following the round-robin rotation."""
+        position = 0
+        depth = 0
+        while True:
+            served_any = False
+            for user_queue in self.queues.values():
+                if depth < len(user_queue):
+                    served_any = True
+                    position += 1
+                    if user_queue[depth] is ticket:
+                        return position
+            if not served_any:
+                return 0
+            depth += 1
+
+    def release(self, ticket: RunTicket):
+        """Frees the ticket's slot or queue entry. Safe to call more than once."""
+        if ticket.released:
+            return
+        ticket.released = True
+        if ticket.admitted.is_set():
+            self.running -= 1
+            self.active.discard(ticket.user_id)
+        else:
+            user_queue = self.queues.get(ticket.user_id)
+            if user_queue and ticket in user_queue:
+                user_queue.remove(ticket)
+                self.queued -= 1
+                if not user_queue:
+                    del self.queues[ticket.user_id]
+        self._dispatch()
+
+    def resize(self, max_concurrent: int):
+        """Changes the number of runs that may execute at once."""
+        self.max_concurrent = max_concurrent
+        self._dispatch()
+
+    def _dispatch(self):
+        while self.running < self.max_concurrent:
+            user_id = next(
+                (user_id for user_id in self.queues if user_id not in self.active),
+                None,
+            )
+            if user_id is None:
+                break
+            user_queue = self.queues.pop(user_id)
+            ticket = user_queue.popleft()
+            if user_queue:
+                self.queues[user_id] = user_queue
+            self.queued -= 1
+            self.running += 1
+            self.active.add(user_id)
+            ticket.admitted.set()
+            logger.info(
+                f"--- Admitted run for {user_id} ({self.running} running, {self.queued} queued) ---"
+            )
+
+
+# Without AURORA_MAX_CONCURRENT_RUNS, app.py resizes this to the browser
+# workers' capacity once they are connected, if AURORA_BROWSER_WORKERS is set.
+run_scheduler = RunScheduler(
+    max_concurrent=int(
+        os.getenv(
+            "AURORA_MAX_CONCURRENT_RUNS", os.getenv("AURORA_BROWSER_POOL_SIZE", "4")
+        )
+    ),
+    max_queue=int(os.getenv("AURORA_MAX_QUEUED_RUNS", "32")),
+    max_queued_per_user=int(os.getenv("AURORA_MAX_QUEUED_RUNS_PER_USER", "3")),
+)
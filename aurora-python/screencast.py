@@ -0,0 +1,185 @@
+import asyncio
+import base64
+import logging
+from typing import Any, Awaitable, Callable, Dict, Set
+
+from playwright.async_api import CDPSession, Page
+
+from frame_diff import Frame
+
+logger = logging.getLogger(__name__)
+
+
+class FrameSubscriber:
+    """
+    A per-viewer mailbox that holds at most one pending frame.
+
+    Publishing never blocks: a newer frame replaces an unsent one and the
+    replaced frame is counted as dropped, so a slow viewer only ever costs one
+    frame of memory and never delays the producer or other viewers.
+    """
+
+    def __init__(self):
+        self._frame: Frame | None = None
+        self._ready = asyncio.Event()
+        self.delivered = 0
+        self.dropped = 0
+
+    def offer(self, frame: Frame):
+        if self._frame is not None:
+            self.dropped += 1
+        self._frame = frame
+        self._ready.set()
+
+    async def get(self) -> Frame:
+        await self._ready.wait()
+        self._ready.clear()
+        frame, self._frame = self._frame, None
+        self.delivered += 1
+        return frame
+
+    def stats(self) -> Dict[str, int]:
+        return {"delivered": self.delivered, "dropped": self.dropped}
+
+
+class ScreencastBroadcaster:
+    """
+    A single frame producer for one Page that fans every frame out to all
+    subscribed viewers.
+
+    On Chromium the frames come from the DevTools `Page.startScreencast`
+    stream, so they are pushed whenever the page repaints. Other browsers fall
+    back to one shared polling loop over `get_screenshot`. Either way the
+    capture cost is independent of the number of viewers.
+
+    Viewers can subscribe before any page is attached and stay subscribed
+    while the broadcaster is re-attached to a different page.
+    """
+
+    def __init__(
+        self,
+        quality: int = 80,
+        every_nth_frame: int = 1,
+        poll_interval: float = 0.5,
+    ):
+        self.screenshot_func: Callable[[], Awaitable[dict | None]] | None = None
+        self.quality = quality
+        self.every_nth_frame = every_nth_frame
+        self.poll_interval = poll_interval
+
+        self.page: Page | None = None
+        self.cdp: CDPSession | None = None
+        self.latest_frame: Frame | None = None
+        self.subscribers: Set[FrameSubscriber] = set()
+
+        self._poll_task: asyncio.Task | None = None
+        self._running = False
+        self._lock = asyncio.Lock()
+
+    async def attach(
+        self, page: Page, screenshot_func: Callable[[], Awaitable[dict | None]]
+    ):
+        """Binds the broadcaster to a page, starting capture if anyone is watching."""
+        async with self._lock:
+            await self._stop()
+            self.page = page
+            self.screenshot_func = screenshot_func
+            self.latest_frame = None
+            if self.subscribers:
+                await self._start()
+
+    async def detach(self):
+        async with self._lock:
+            await self._stop()
+            self.page = None
+            self.screenshot_func = None
+
+    async def subscribe(self) -> FrameSubscriber:
+        subscriber = FrameSubscriber()
+        async with self._lock:
+            self.subscribers.add(subscriber)
+            if not self._running and self.page:
+                await self._start()
+
+        # Screencast frames only arrive on repaint, so an idle page would leave
+        # a new viewer with a blank view. Seed it with the last known frame.
+        frame = self.latest_frame
+        if frame is None and self.screenshot_func:
+            screenshot_data = await self.screenshot_func()
+            if screenshot_data and "screenshot" in screenshot_data:
+                frame = Frame(screenshot_data["screenshot"], quality=self.quality)
+        if frame is not None:
+            subscriber.offer(frame)
+        return subscriber
+
+    async def unsubscribe(self, subscriber: FrameSubscriber):
+        async with self._lock:
+            self.subscribers.discard(subscriber)
+            if not self.subscribers:
+                await self._stop()
+
+    def _publish(self, data: bytes):
+        frame = Frame(data, quality=self.quality)
+        # Identical bytes mean an identical viewport; drop them before any
+        # viewer spends time decoding or sending.
+        if self.latest_frame and self.latest_frame.digest == frame.digest:
+            return
+        self.latest_frame = frame
+        for subscriber in self.subscribers:
+            subscriber.offer(frame)
+
+    async def _start(self):
+        try:
+            self.cdp = await self.page.context.new_cdp_session(self.page)
+            self.cdp.on("Page.screencastFrame", self._on_screencast_frame)
+            await self.cdp.send(
+                "Page.startScreencast",
+                {
+                    "format": "jpeg",
+                    "quality": self.quality,
+                    "everyNthFrame": self.every_nth_frame,
+                },
+            )
+            logger.info("--- Screencast started ---")
+        except Exception as e:
+            logger.warning(
+                f"CDP screencast unavailable ({e}), falling back to screenshot polling."
+            )
+            self.cdp = None
+            self._poll_task = asyncio.create_task(self._poll_loop())
+        self._running = True
+
+    async def _stop(self):
+        if self.cdp:
+            try:
+                await self.cdp.send("Page.stopScreencast")
+                await self.cdp.detach()
+            except Exception as e:
+                logger.debug(f"Error stopping screencast: {e}")
+            self.cdp = None
+            logger.info("--- Screencast stopped ---")
+        if self._poll_task:
+            self._poll_task.cancel()
+            self._poll_task = None
+        self._running = False
+
+    async def _on_screencast_frame(self, params: Dict[str, Any]):
+        cdp = self.cdp
+        if cdp is None:
+            return
+        try:
+            # Chromium stops sending frames until the previous one is acked.
+            await cdp.send(
+                "Page.screencastFrameAck", {"sessionId": params["sessionId"]}
+            )
+        except Exception as e:
+            logger.debug(f"Error acking screencast frame: {e}")
+            return
+        self._publish(base64.b64decode(params["data"]))
+
+    async def _poll_loop(self):
+        while True:
+            screenshot_data = await self.screenshot_func()
+            if screenshot_data and "screenshot" in screenshot_data:
+                self._publish(screenshot_data["screenshot"])
+            await asyncio.sleep(self.poll_interval)
@@ -0,0 +1,269 @@
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional, Tuple
+
+from google.adk.events import Event
+from google.adk.sessions import BaseSessionService, DatabaseSessionService, Session
+from google.adk.sessions.base_session_service import (
+    GetSessionConfig,
+    ListEventsResponse,
+    ListSessionsResponse,
+)
+from google.adk.sessions.database_session_service import StorageEvent, StorageSession
+from sqlalchemy import delete, select
+
+logger = logging.getLogger(__name__)
+
+# Per-step working data the agents keep in session state. None of it is
+# needed once a run is over, and element lists in particular can be large.
+TRANSIENT_KEYS = (
+    "clickable_elements",
+    "form_elements",
+    "form_fill_fields",
+    "form_fill_choices",
+    "form_fill_steps",
+    "batch_resolutions",
+    "current_step_index",
+    "suggested_urls",
+    "raw_steps",
+)
+
+
+def _size(value: Any) -> int:
+    return len(json.dumps(value, default=str))
+
+
+class BoundedSessionService(BaseSessionService):
+    """
+    A session service backed by `DatabaseSessionService` (SQLite by default)
+    that keeps memory and disk use bounded:
+
+    - up to `hot_size` sessions are kept in memory, least recently used
+      first out; the rest are loaded from the database on demand. With
+      `hot_size=0` every request reads the session from the database, which
+      is what API replicas sharing one database need: a cached session goes
+      stale once another replica appends to it, and ADK then rejects its
+      next event as stale
+    - sessions idle for longer than `idle_ttl` seconds are deleted
+    - transient state values larger than `max_value_bytes` are not written
+      to the database, and `trim_state` drops transient keys from a session
+      whose state has grown past `max_state_bytes`
+    - only the last `max_events` events are kept, in memory and, once
+      `trim_state` runs after each run, in the database too; the session id
+      of a client never changes, so its stored history would otherwise grow
+      for good and every cold load would read all of it
+    """
+
+    def __init__(
+        self,
+        db_url: str,
+        hot_size: int = 128,
+        idle_ttl: float = 24 * 3600,
+        max_state_bytes: int = 64 * 1024,
+        max_value_bytes: int = 16 * 1024,
+        max_events: int = 200,
+    ):
+        self.db = DatabaseSessionService(db_url)
+        self.hot_size = hot_size
+        self.idle_ttl = idle_ttl
+        self.max_state_bytes = max_state_bytes
+        self.max_value_bytes = max_value_bytes
+        self.max_events = max_events
+        self._hot: OrderedDict[Tuple[str, str, str], Session] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create_session(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        state: Optional[dict[str, Any]] = None,
+        session_id: Optional[str] = None,
+    ) -> Session:
+        session = self.db.create_session(
+            app_name=app_name, user_id=user_id, state=state, session_id=session_id
+        )
+        self._remember(session)
+        return session
+
+    def get_session(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        session_id: str,
+        config: Optional[GetSessionConfig] = None,
+    ) -> Optional[Session]:
+        key = (app_name, user_id, session_id)
+        with self._lock:
+            session = self._hot.get(key)
+            if session:
+                self._hot.move_to_end(key)
+        if session is None:
+            session = self.db.get_session(
+                app_name=app_name, user_id=user_id, session_id=session_id
+            )
+            if session is None:
+                return None
+            session.events = session.events[-self.max_events :]
+            self._remember(session)
+
+        if session.last_update_time < self._cutoff().timestamp():
+            logger.info(f"Session {session_id} expired after being idle.")
+            self.delete_session(
+                app_name=app_name, user_id=user_id, session_id=session_id
+            )
+            return None
+        return session
+
+    def list_sessions(self, *, app_name: str, user_id: str) -> ListSessionsResponse:
+        return self.db.list_sessions(app_name=app_name, user_id=user_id)
+
+    def delete_session(self, *, app_name: str, user_id: str, session_id: str) -> None:
+        with self._lock:
+            self._hot.pop((app_name, user_id, session_id), None)
+        with self.db.DatabaseSessionFactory() as db:
+            db.execute(
+                delete(StorageEvent).where(
+                    StorageEvent.app_name == app_name,
+                    StorageEvent.user_id == user_id,
+                    StorageEvent.session_id == session_id,
+                )
+            )
+            db.execute(
+                delete(StorageSession).where(
+                    StorageSession.app_name == app_name,
+                    StorageSession.user_id == user_id,
+                    StorageSession.id == session_id,
+                )
+            )
+            db.commit()
+
+    def list_events(
+        self, *, app_name: str, user_id: str, session_id: str
+    ) -> ListEventsResponse:
+        session = self.get_session(
+            app_name=app_name, user_id=user_id, session_id=session_id
+        )
+        return ListEventsResponse(events=session.events if session else [])
+
+    def append_event(self, session: Session, event: Event) -> Event:
+        delta = event.actions.state_delta if event.actions else None
+        # Oversized transient values are applied to the live session but
+        # never written to the database.
+        held_back = {
+            key: delta.pop(key)
+            for key in TRANSIENT_KEYS
+            if delta and key in delta and _size(delta[key]) > self.max_value_bytes
+        }
+        try:
+            self.db.append_event(session, event)
+        finally:
+            if held_back:
+                delta.update(held_back)
+                session.state.update(held_back)
+        if len(session.events) > self.max_events:
+            del session.events[: -self.max_events]
+        return event
+
+    def trim_state(self, session: Session):
+        """
+        Drops transient keys from the session, largest first, until its state
+        fits in `max_state_bytes`, and all but the last `max_events` events,
+        both in memory and in the database. Meant to be called once a run is
+        over.
+        """
+        sizes = {
+            key: _size(session.state[key])
+            for key in TRANSIENT_KEYS
+            if key in session.state
+        }
+        total = _size(session.state)
+        trimmed = []
+        for key in sorted(sizes, key=sizes.get, reverse=True):
+            if total <= self.max_state_bytes:
+                break
+            del session.state[key]
+            trimmed.append(key)
+            total -= sizes[key]
+            logger.info(
+                f"Trimmed '{key}' ({sizes[key]} bytes) from session {session.id}."
+            )
+
+        match = (
+            StorageEvent.app_name == session.app_name,
+            StorageEvent.user_id == session.user_id,
+            StorageEvent.session_id == session.id,
+        )
+        recent = (
+            select(StorageEvent.id)
+            .where(*match)
+            .order_by(StorageEvent.timestamp.desc())
+            .limit(self.max_events)
+        )
+        with self.db.DatabaseSessionFactory() as db:
+            db.execute(
+                delete(StorageEvent).where(*match, StorageEvent.id.not_in(recent))
+            )
+            stored = db.get(
+                StorageSession, (session.app_name, session.user_id, session.id)
+            )
+            if stored is not None and any(key in stored.state for key in trimmed):
+                stored.state = {
+                    key: value
+                    for key, value in stored.state.items()
+                    if key not in trimmed
+                }
+            db.commit()
+            if stored is not None:
+                db.refresh(stored)
+                # Otherwise the next append would find the session stale.
+                session.last_update_time = stored.update_time.timestamp()
+
+    def evict_idle(self) -> int:
+        """Deletes every session idle for longer than `idle_ttl`. Returns how many."""
+        cutoff = self._cutoff()
+        with self.db.DatabaseSessionFactory() as db:
+            expired = db.execute(
+                select(
+                    StorageSession.app_name, StorageSession.user_id, StorageSession.id
+                ).where(StorageSession.update_time < cutoff)
+            ).all()
+        for app_name, user_id, session_id in expired:
+            self.delete_session(
+                app_name=app_name, user_id=user_id, session_id=session_id
+            )
+        if expired:
+            logger.info(f"Evicted {len(expired)} idle sessions.")
+        return len(expired)
+
+    def stats(self) -> Dict[str, int]:
+        return {"hot_sessions": len(self._hot)}
+
+    def _remember(self, session: Session):
+        key = (session.app_name, session.user_id, session.id)
+        with self._lock:
+            self._hot[key] = session
+            self._hot.move_to_end(key)
+            while len(self._hot) > self.hot_size:
+                self._hot.popitem(last=False)
+
+    def _cutoff(self) -> datetime:
+        # update_time is stamped with SQLite's CURRENT_TIMESTAMP: naive UTC.
+        # ADK turns it into last_update_time as if it were local time, so
+        # the cutoff is kept naive too and compared the same way.
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        return now - timedelta(seconds=self.idle_ttl)
+
+
+# Set AURORA_SESSION_HOT_SIZE=0 when several API processes share the database.
+session_service = BoundedSessionService(
+    db_url=os.getenv("AURORA_SESSION_DB_URL", "sqlite:///sessions.db"),
+    hot_size=int(os.getenv("AURORA_SESSION_HOT_SIZE", "128")),
+    idle_ttl=float(os.getenv("AURORA_SESSION_IDLE_TTL", str(24 * 3600))),
+    max_state_bytes=int(os.getenv("AURORA_SESSION_MAX_STATE_BYTES", str(64 * 1024))),
+)
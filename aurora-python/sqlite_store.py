@@ -0,0 +1,100 @@
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Tuple
+
+
+class SqliteStore:
+    """
+    A persistent table of JSON values keyed by string, shared by the plan,
+    decision and macro caches; each of them only shapes its keys and values.
+
+    Entries expire `ttl` seconds after they were stored and the least recently
+    used ones are evicted beyond `max_entries`.
+    """
+
+    def __init__(self, path: str, table: str, ttl: float, max_entries: int):
+        self.path = path
+        self.table = table
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+            """)
+        self._db.commit()
+
+    def get(
+        self,
+        key: str,
+        fallback: Callable[[Iterable[Tuple[str, Any]]], str | None] | None = None,
+    ) -> Tuple[str, Any] | None:
+        """
+        Returns the key that matched and its value, or None on a miss. With no
+        entry under `key`, `fallback` may pick another key from the stored
+        (key, value) pairs.
+        """
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                f"DELETE FROM {self.table} WHERE created_at < ?", (now - self.ttl,)
+            )
+            row = self._db.execute(
+                f"SELECT key, value FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None and fallback:
+                items = (
+                    (r[0], json.loads(r[1]))
+                    for r in self._db.execute(f"SELECT key, value FROM {self.table}")
+                )
+                match = fallback(items)
+                if match is not None:
+                    row = self._db.execute(
+                        f"SELECT key, value FROM {self.table} WHERE key = ?", (match,)
+                    ).fetchone()
+            if row is None:
+                self._db.commit()
+                self.misses += 1
+                return None
+
+            self._db.execute(
+                f"UPDATE {self.table} SET last_used = ? WHERE key = ?", (now, row[0])
+            )
+            self._db.commit()
+            self.hits += 1
+        return row[0], json.loads(row[1])
+
+    def put(self, key: str, value: Any):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, created_at, last_used) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now, now),
+            )
+            self._db.execute(
+                f"""
+                DELETE FROM {self.table} WHERE key NOT IN (
+                    SELECT key FROM {self.table} ORDER BY last_used DESC LIMIT ?
+                )
+                """,
+                (self.max_entries,),
+            )
+            self._db.commit()
+
+    def delete(self, key: str):
+        with self._lock:
+            self._db.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            self._db.commit()
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
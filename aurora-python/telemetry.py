@@ -0,0 +1,315 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Tuple
+
+from google.adk.agents import BaseAgent, LlmAgent
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.models import LlmRequest, LlmResponse
+from google.genai import types
+
+logger = logging.getLogger(__name__)
+
+SECONDS_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+COUNT_BUCKETS = (0, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+# Help text for every metric that is exported.
+METRICS = {
+    "aurora_run_seconds": ("histogram", "Wall time of a whole agent run."),
+    "aurora_planning_seconds": ("histogram", "Time spent producing a plan."),
+    "aurora_step_seconds": ("histogram", "Wall time of one plan step."),
+    "aurora_llm_seconds": ("histogram", "Latency of one model call, by agent."),
+    "aurora_llm_tokens_estimated_total": (
+        "counter",
+        "Prompt and completion tokens by agent, estimated at four characters per token.",
+    ),
+    "aurora_element_scan_seconds": ("histogram", "Time to refresh the element caches."),
+    "aurora_elements_found": ("histogram", "Elements found per scan, by kind."),
+    "aurora_action_seconds": ("histogram", "Time of a browser action, by action."),
+    "aurora_readiness_wait_seconds": (
+        "histogram",
+        "Time spent waiting for a page to settle, by what preceded it.",
+    ),
+    "aurora_screenshot_seconds": ("histogram", "Time to capture a screenshot."),
+    "aurora_rpc_seconds": (
+        "histogram",
+        "Round trip of a browser worker call, by method.",
+    ),
+}
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+class _Histogram:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """Histograms and counters rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._histograms: Dict[str, Dict[LabelKey, _Histogram]] = {}
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value: float, buckets=SECONDS_BUCKETS, **labels: str):
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            series.setdefault(key, _Histogram(buckets)).observe(value)
+
+    def increment(self, name: str, value: float = 1, **labels: str):
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._histograms.items()):
+                lines += _header(name, "histogram")
+                for key, histogram in series.items():
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        lines.append(
+                            f"{name}_bucket{_labels(key, le=_number(bound))} {count}"
+                        )
+                    lines.append(
+                        f'{name}_bucket{_labels(key, le="+Inf")} {histogram.count}'
+                    )
+                    lines.append(f"{name}_sum{_labels(key)} {histogram.sum}")
+                    lines.append(f"{name}_count{_labels(key)} {histogram.count}")
+            for name, series in sorted(self._counters.items()):
+                lines += _header(name, "counter")
+                for key, value in series.items():
+                    lines.append(f"{name}{_labels(key)} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _header(name: str, kind: str) -> List[str]:
+    help_text = METRICS.get(name, (kind, name))[1]
+    return [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+
+
+def _labels(key: LabelKey, **extra: str) -> str:
+    pairs = list(key) + list(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else str(value)
+
+
+metrics = MetricsRegistry()
+
+
+class RunTrace:
+    """The spans recorded during one agent run, exportable as JSON."""
+
+    def __init__(self, user_id: str):
+        self.run_id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.started = time.time()
+        self._origin = time.monotonic()
+        self.spans: List[Dict[str, Any]] = []
+
+    def add(self, name: str, started: float, duration: float, attributes: dict):
+        self.spans.append(
+            {
+                "name": name,
+                "start": round(started - self._origin, 4),
+                "duration": round(duration, 4),
+                **({"attributes": attributes} if attributes else {}),
+            }
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "run_id": self.run_id,
+            "user_id": self.user_id,
+            "started": self.started,
+            "spans": self.spans,
+        }
+
+
+_current_trace: ContextVar[RunTrace | None] = ContextVar("current_trace", default=None)
+
+
+@contextmanager
+def trace_run(user_id: str) -> Iterator[RunTrace]:
+    """
+    Collects the spans of the run in progress. If AURORA_TRACE_DIR is set, the
+    trace is written there as <run_id>.json when the run ends.
+    """
+    trace = RunTrace(user_id)
+    token = _current_trace.set(trace)
+    started = time.monotonic()
+    try:
+        yield trace
+    finally:
+        duration = time.monotonic() - started
+        metrics.observe("aurora_run_seconds", duration)
+        trace.add("run", started, duration, {})
+        _current_trace.reset(token)
+        _export(trace)
+
+
+def _export(trace: RunTrace):
+    directory = os.getenv("AURORA_TRACE_DIR")
+    if not directory:
+        return
+    try:
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f"{trace.run_id}.json"), "w") as f:
+            json.dump(trace.to_dict(), f, indent=2)
+    except OSError as e:
+        logger.error(f"Could not export trace {trace.run_id}: {e}")
+
+
+@contextmanager
+def span(metric: str, **labels: str) -> Iterator[Dict[str, Any]]:
+    """
+    Times a block into the `metric` histogram and, during a run, into the
+    run's trace. The yielded dict takes extra attributes for the trace.
+    """
+    attributes: Dict[str, Any] = {}
+    started = time.monotonic()
+    try:
+        yield attributes
+    finally:
+        duration = time.monotonic() - started
+        metrics.observe(metric, duration, **labels)
+        trace = _current_trace.get()
+        if trace:
+            name = metric.removeprefix("aurora_").removesuffix("_seconds")
+            trace.add(name, started, duration, {**labels, **attributes})
+
+
+# --- Model call instrumentation ---
+
+# task -> {(invocation_id, agent name): (start time, estimated prompt tokens)}
+# of the model calls in flight. Parallel plan branches run the same agents at
+# once, each in its own task, but within a task an agent has one call in
+# flight. A call that raises never reaches _after_model, so a task's calls are
+# dropped when the task finishes.
+_llm_calls: Dict[asyncio.Task, Dict[Tuple[str, str], Tuple[float, int]]] = {}
+
+
+def _calls_in_task() -> Dict[Tuple[str, str], Tuple[float, int]]:
+    task = asyncio.current_task()
+    calls = _llm_calls.get(task)
+    if calls is None:
+        calls = _llm_calls[task] = {}
+        task.add_done_callback(lambda done: _llm_calls.pop(done, None))
+    return calls
+
+
+def _call_key(callback_context: CallbackContext) -> Tuple[str, str]:
+    return (callback_context.invocation_id, callback_context.agent_name)
+
+
+def _estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+def _part_text(part: types.Part) -> str:
+    """What a part costs in tokens: its text, function calls and function results."""
+    text = part.text or ""
+    if part.function_call:
+        text += (part.function_call.name or "") + json.dumps(
+            part.function_call.args or {}, default=str
+        )
+    if part.function_response:
+        text += json.dumps(part.function_response.response or {}, default=str)
+    return text
+
+
+def _before_model(
+    callback_context: CallbackContext, llm_request: LlmRequest
+) -> LlmResponse | None:
+    config = llm_request.config
+    prompt = str(config.system_instruction or "") if config else ""
+    prompt += "".join(
+        _part_text(part)
+        for content in llm_request.contents
+        for part in (content.parts or [])
+    )
+    _calls_in_task()[_call_key(callback_context)] = (
+        time.monotonic(),
+        _estimate_tokens(prompt),
+    )
+    return None
+
+
+def _after_model(
+    callback_context: CallbackContext, llm_response: LlmResponse
+) -> LlmResponse | None:
+    agent = callback_context.agent_name
+    call = _calls_in_task().pop(_call_key(callback_context), None)
+    if call is None:
+        return None
+    started, prompt_tokens = call
+    duration = time.monotonic() - started
+    parts = llm_response.content.parts if llm_response.content else None
+    completion_tokens = _estimate_tokens(
+        "".join(_part_text(part) for part in parts or [])
+    )
+
+    metrics.observe("aurora_llm_seconds", duration, agent=agent)
+    metrics.increment(
+        "aurora_llm_tokens_estimated_total", prompt_tokens, agent=agent, kind="prompt"
+    )
+    metrics.increment(
+        "aurora_llm_tokens_estimated_total",
+        completion_tokens,
+        agent=agent,
+        kind="completion",
+    )
+    trace = _current_trace.get()
+    if trace:
+        trace.add(
+            "llm",
+            started,
+            duration,
+            {
+                "agent": agent,
+                "prompt_tokens_estimate": prompt_tokens,
+                "completion_tokens_estimate": completion_tokens,
+            },
+        )
+    return None
+
+
+def instrument_agents(agent: BaseAgent):
+    """Adds model call timing and token counting to every LlmAgent under `agent`."""
+    if isinstance(agent, LlmAgent):
+        if agent.before_model_callback or agent.after_model_callback:
+            logger.warning(f"Not instrumenting {agent.name}: it has model callbacks.")
+        else:
+            agent.before_model_callback = _before_model
+            agent.after_model_callback = _after_model
+    for sub_agent in agent.sub_agents:
+        instrument_agents(sub_agent)